@@ -0,0 +1,57 @@
+"""Benchmark of import time of the spectra analyzer modules measured by ``python -X importtime``.
+Every measurement runs in a fresh interpreter so nothing is imported in advance.
+
+Execute from the repository root::
+
+    python benchmarks/bench_import.py --module spectra_analyzer.server
+"""
+import subprocess
+import sys
+import click
+
+HEAVY_MODULES = ("astropy", "mlpy", "matplotlib", "spectra_downloader")
+
+
+def measure(module):
+    """
+    Imports passed module in a new interpreter.
+    :param module: Name of the imported module.
+    :return: Tuple (cumulative import time in seconds, list of (time, module) of the slowest
+    direct imports of the module, list of imported heavy modules).
+    """
+    code = "import sys, {0}; print(','.join(m for m in {1!r} if m in sys.modules))".format(module, HEAVY_MODULES)
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    total = 0
+    imports = list()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() == module:
+            total = int(cumulative) / 10 ** 6
+        elif depth == 1:
+            imports.append((int(cumulative) / 10 ** 6, name.strip()))
+    heavy = [name for name in process.stdout.strip().split(",") if name]
+    return total, sorted(imports, reverse=True)[:10], heavy
+
+
+@click.command()
+@click.option("--module", default="spectra_analyzer.server", help="Measured module.")
+@click.option("--repeat", default=5, help="Number of measurements.")
+def main(module, repeat):
+    """Measure cold import time of the module."""
+    results = [measure(module) for _ in range(repeat)]
+    total, imports, heavy = min(results, key=lambda result: result[0])
+    print("{} imported in {:.3f} s (best of {})".format(module, total, repeat))
+    print("heavy modules imported: {}".format(", ".join(heavy) if heavy else "none"))
+    print("slowest direct imports:")
+    for seconds, name in imports:
+        print("  {:8.3f} s  {}".format(seconds, name))
+
+
+if __name__ == "__main__":
+    main()
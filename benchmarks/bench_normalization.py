@@ -0,0 +1,39 @@
+"""Benchmark of spectrum normalization. Compares the original normalization using Python builtin
+min/max functions with the vectorized normalization strategies.
+
+Execute from the repository root::
+
+    python benchmarks/bench_normalization.py --size 10000000
+"""
+import timeit
+import click
+import numpy
+from spectra_analyzer import analyzer
+
+
+def builtin_minmax(data):
+    """Original normalization iterating over the array in the interpreter."""
+    return (data - min(data)) / (max(data) - min(data))
+
+
+@click.command()
+@click.option("--size", default=10 ** 7, help="Number of spectrum samples.")
+@click.option("--repeat", default=3, help="Number of measurements of each variant.")
+def main(size, repeat):
+    """Measure normalization of a random spectrum with a few NaN values."""
+    data = numpy.random.random(size) * 1000
+    data[::size // 100] = numpy.nan
+    clean = analyzer.fill_nan(data.copy())
+    variants = [
+        ("builtin min/max", lambda: builtin_minmax(clean), 1),
+        ("fill_nan", lambda: analyzer.fill_nan(data.copy()), repeat),
+    ]
+    for strategy in sorted(analyzer.NORMALIZATIONS):
+        variants.append((strategy, lambda s=strategy: analyzer.normalize(clean.copy(), s), repeat))
+    for name, function, number in variants:
+        best = min(timeit.repeat(function, number=1, repeat=number))
+        print("{:<20} {:10.4f} s".format(name, best))
+
+
+if __name__ == "__main__":
+    main()
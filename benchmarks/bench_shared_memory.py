@@ -0,0 +1,61 @@
+"""Benchmark of handing transformed spectra to worker processes. Compares pickling of the whole
+Spectrum instance with passing a handle of the spectrum stored in shared memory.
+
+Execute from the repository root::
+
+    python benchmarks/bench_shared_memory.py --size 1000000
+"""
+import time
+import pickle
+import multiprocessing
+import click
+import numpy
+from spectra_analyzer import analyzer, shm
+
+
+def touch(spectrum):
+    """Worker task reading the transformation of every scale, so both variants really access the data."""
+    return float(numpy.abs(spectrum._transformation[:, ::4096]).sum())
+
+
+def touch_shared(handle):
+    """Worker task attaching the shared spectrum."""
+    return touch(handle.attach())
+
+
+def measure(pool, function, argument, repeat):
+    """Returns the best time of a worker round trip in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pool.apply(function, (argument,))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@click.command()
+@click.option("--size", default=10 ** 6, help="Number of spectrum samples.")
+@click.option("--scales", default=80, help="Number of transformation scales.")
+@click.option("--repeat", default=5, help="Number of measurements of each variant.")
+def main(size, scales, repeat):
+    """Measure handoff of a random spectrum and its transformation to a worker process."""
+    data = numpy.cumsum(numpy.random.standard_normal(size))
+    spectrum = analyzer.Spectrum(analyzer.normalize(data, "minmax"), scales=numpy.geomspace(2, size / 4, scales))
+    print("transformation {} x {}, {:.1f} MB".format(*spectrum._transformation.shape,
+                                                     spectrum._transformation.nbytes / 1e6))
+    start = time.perf_counter()
+    data = pickle.dumps(spectrum, protocol=pickle.HIGHEST_PROTOCOL)
+    pickle.loads(data)
+    print("{:<28} {:10.4f} s ({:.1f} MB)".format("pickle dumps + loads", time.perf_counter() - start, len(data) / 1e6))
+    start = time.perf_counter()
+    handle = shm.SharedSpectrum.create(spectrum)
+    print("{:<28} {:10.4f} s ({} B handle)".format("shared memory create", time.perf_counter() - start,
+                                                   len(pickle.dumps(handle))))
+    with multiprocessing.Pool(1) as pool:
+        print("{:<28} {:10.4f} s".format("worker round trip, pickle", measure(pool, touch, spectrum, repeat)))
+        print("{:<28} {:10.4f} s".format("worker round trip, shared", measure(pool, touch_shared, handle, repeat)))
+    shm.release(handle)
+
+
+if __name__ == "__main__":
+    main()
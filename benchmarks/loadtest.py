@@ -0,0 +1,309 @@
+"""Load test of the analyzer simulating many concurrent users. Every simulated client connects to the
+/analyzer namespace, lists a directory of synthetic spectra (change_path), analyzes spectra
+(analyze_file) and moves the transformation sliders in bursts (slider_changed). Latency percentiles
+of every event, throughput, error rate and resident memory of the server are reported.
+
+Requires the python-socketio client with its transport dependencies::
+
+    python3 -m pip install "python-socketio[client]" psutil
+
+Execute from the repository root, a local server with synthetic spectra is started implicitly::
+
+    python benchmarks/loadtest.py --clients 20 --duration 60
+
+Scaling is measured by comparing throughput of runs with a different number of local worker processes
+(``--workers``), which share a SQLite message queue and spectrum store::
+
+    python benchmarks/loadtest.py --clients 40 --workers 1
+    python benchmarks/loadtest.py --clients 40 --workers 4
+
+or test already running server (spectra are generated into a directory it can read)::
+
+    python benchmarks/loadtest.py --url http://127.0.0.1:5000 --server-pid 1234 --directory /tmp/loadtest
+"""
+import os
+import sys
+import time
+import queue
+import random
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import click
+import numpy
+
+try:
+    import socketio
+except ImportError:
+    socketio = None
+
+NAMESPACE = "/analyzer"
+SOCKETIO_PATH = "/spectra-analyzer/socket.io"
+TIMEOUT = 60  # maximal time in seconds to wait for a response
+
+
+def generate_spectra(directory, count, size, seed=0):
+    """
+    Writes synthetic spectra - noisy continuum with random absorption and emission lines - as CSV files.
+    :param directory: Target directory.
+    :param count: Number of spectra.
+    :param size: Number of samples of every spectrum.
+    :param seed: Seed of the random generator, so runs are comparable.
+    :return: List of paths to the spectra.
+    """
+    os.makedirs(directory, exist_ok=True)
+    state = numpy.random.RandomState(seed)
+    wavelength = numpy.linspace(6250, 6770, size)
+    paths = list()
+    for i in range(count):
+        flux = 1 + 0.1 * numpy.sin(wavelength / state.uniform(50, 200)) + state.normal(0, 0.01, size)
+        for _ in range(state.randint(5, 30)):
+            center, width, depth = state.uniform(6250, 6770), state.uniform(0.2, 3), state.uniform(-0.8, 0.8)
+            flux -= depth * numpy.exp(-0.5 * ((wavelength - center) / width) ** 2)
+        path = os.path.join(directory, "synthetic{:04d}.csv".format(i))
+        numpy.savetxt(path, numpy.column_stack((wavelength, flux)), delimiter=",")
+        paths.append(path)
+    return paths
+
+
+def start_server(port, env=None):
+    """Starts local spectra-analyzer process and waits until it accepts requests."""
+    process = subprocess.Popen([sys.executable, "-c", "from spectra_analyzer.server import main; main()",
+                                "--port", str(port), "--preload"], env=env)
+    url = "http://127.0.0.1:{}".format(port)
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise click.ClickException("server exited with code {}".format(process.returncode))
+        try:
+            urllib.request.urlopen(url + "/spectra-analyzer/", timeout=1)
+            return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise click.ClickException("server did not start in {} s".format(TIMEOUT))
+
+
+def rss(pid):
+    """Returns resident set size of the process in bytes or None if it cannot be determined."""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class Statistics:
+    """Thread safe collection of event latencies and errors of all simulated clients."""
+
+    def __init__(self):
+        self.latencies = dict()  # event -> list of latencies in seconds
+        self.errors = dict()  # event -> number of failed requests
+        self._lock = threading.Lock()
+
+    def record(self, event, latency):
+        with self._lock:
+            self.latencies.setdefault(event, list()).append(latency)
+
+    def fail(self, event):
+        with self._lock:
+            self.errors[event] = self.errors.get(event, 0) + 1
+
+    def report(self, elapsed):
+        """Prints latency percentiles, throughput and error rate of every event."""
+        click.echo("{:<28} {:>7} {:>7} {:>9} {:>9} {:>9} {:>9} {:>8}".format(
+            "event", "count", "errors", "p50 ms", "p90 ms", "p99 ms", "max ms", "req/s"))
+        for event in sorted(set(self.latencies) | set(self.errors)):
+            values = numpy.array(self.latencies.get(event, [numpy.nan])) * 1000
+            count = len(self.latencies.get(event, []))
+            errors = self.errors.get(event, 0)
+            p50, p90, p99 = numpy.percentile(values, [50, 90, 99])
+            click.echo("{:<28} {:>7} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>8.2f}".format(
+                event, count, errors, p50, p90, p99, numpy.max(values), count / elapsed))
+        total = sum(len(values) for values in self.latencies.values())
+        errors = sum(self.errors.values())
+        click.echo("throughput {:.2f} responses/s, error rate {:.2%}".format(
+            total / elapsed, errors / max(total + errors, 1)))
+
+
+class SimulatedClient:
+    """
+    One analyzer user. Received messages are queued, the session script waits for the expected
+    ones. Slider responses are not identified by the protocol, so they are matched to requests in order.
+    """
+
+    def __init__(self, url, directory, paths, statistics, bursts, burst_size):
+        self.url = url
+        self.directory = directory
+        self.paths = paths
+        self.statistics = statistics
+        self.bursts = bursts
+        self.burst_size = burst_size
+        self.messages = queue.Queue()
+        self.client = socketio.Client(reconnection=False)
+        for event in ("directory_info", "spectrum_preview", "scales_computed", "cwt_plotted", "file_analyzed",
+                      "transformation_updated"):
+            self.client.on(event, self._handler(event), namespace=NAMESPACE)
+
+    def _handler(self, event):
+        def handle(data=None):
+            self.messages.put((event, time.perf_counter(), data))
+        return handle
+
+    def wait(self, event, path=None):
+        """Returns (time, data) of the next message of the event. Messages of other events
+        and messages of other spectra (stale analysis results) are skipped."""
+        deadline = time.monotonic() + TIMEOUT
+        while True:
+            event_name, received, data = self.messages.get(timeout=max(deadline - time.monotonic(), 0))
+            if event_name != event:
+                continue
+            if path is not None and isinstance(data, dict) and data.get("path", path) != path:
+                continue
+            return received, data
+
+    def request(self, name, event, message, response, path=None):
+        """Emits a message and records latency of the response. Returns the response data or None on failure."""
+        start = time.perf_counter()
+        self.client.emit(event, message, namespace=NAMESPACE)
+        try:
+            received, data = self.wait(response, path)
+        except queue.Empty:
+            self.statistics.fail(name)
+            return None
+        self.statistics.record(name, received - start)
+        return data
+
+    def analyze(self, path):
+        """Analyzes the spectrum and records latency of every stage. Returns number of scales or None."""
+        start = time.perf_counter()
+        self.client.emit("analyze_file", path, namespace=NAMESPACE)
+        scales = None
+        for stage in ("spectrum_preview", "scales_computed", "cwt_plotted", "file_analyzed"):
+            try:
+                received, data = self.wait(stage, path)
+            except queue.Empty:
+                self.statistics.fail("analyze_file/" + stage)
+                return None
+            if data.get("invalid"):
+                self.statistics.fail("analyze_file/" + stage)
+                return None
+            self.statistics.record("analyze_file/" + stage, received - start)
+            if stage == "scales_computed":
+                scales = data["scales"]
+        return scales
+
+    def sliders(self, scales):
+        """Moves sliders in a burst and records latency of every matched response."""
+        starts = list()
+        for _ in range(self.burst_size):
+            wSize = random.randint(0, min(10, scales - 1))
+            freq0 = random.randint(0, scales - 1 - wSize)
+            starts.append(time.perf_counter())
+            self.client.emit("slider_changed", {"freq0": freq0, "wSize": wSize, "only-transformation": False},
+                             namespace=NAMESPACE)
+        for start in starts:
+            try:
+                received, _ = self.wait("transformation_updated")
+            except queue.Empty:
+                self.statistics.fail("slider_changed")
+                continue
+            self.statistics.record("slider_changed", received - start)
+
+    def run(self, deadline):
+        """Runs sessions until the deadline."""
+        start = time.perf_counter()
+        try:
+            self.client.connect(self.url, namespaces=[NAMESPACE], socketio_path=SOCKETIO_PATH, wait_timeout=TIMEOUT)
+            self.wait("directory_info")
+        except (socketio.exceptions.ConnectionError, queue.Empty):
+            self.statistics.fail("connect")
+            return
+        self.statistics.record("connect", time.perf_counter() - start)
+        try:
+            if self.request("change_path", "change_path", self.directory, "directory_info") is None:
+                return
+            while time.monotonic() < deadline:
+                scales = self.analyze(random.choice(self.paths))
+                if scales is None:
+                    continue
+                for _ in range(self.bursts):
+                    self.sliders(scales)
+        finally:
+            self.client.disconnect()
+
+
+@click.command()
+@click.option("--url", help="URL of a running server, a local server is started if omitted.")
+@click.option("--port", default=5055, help="Port of the first started local server.")
+@click.option("--workers", default=1, help="Number of started local server processes. Multiple workers share "
+                                          "SQLite message queue and spectrum store, clients are distributed evenly.")
+@click.option("--server-pid", type=int, help="Process identifier of the running server for memory reporting.")
+@click.option("--directory", type=click.Path(file_okay=False), help="Directory of generated spectra.")
+@click.option("--spectra", default=10, help="Number of generated spectra.")
+@click.option("--size", default=20000, help="Number of samples of generated spectra.")
+@click.option("--clients", default=10, help="Number of concurrent clients.")
+@click.option("--duration", default=30.0, help="Duration of the test in seconds.")
+@click.option("--bursts", default=3, help="Number of slider bursts after every analysis.")
+@click.option("--burst-size", default=5, help="Number of slider_changed messages in one burst.")
+@click.option("--seed", default=0, help="Seed of the random generators.")
+def main(url, port, workers, server_pid, directory, spectra, size, clients, duration, bursts, burst_size, seed):
+    """Simulate concurrent analyzer clients and report latencies, throughput, errors and server memory."""
+    if socketio is None:
+        raise click.ClickException('python-socketio client is not installed, '
+                                   'install it by: python3 -m pip install "python-socketio[client]"')
+    random.seed(seed)
+    directory = os.path.abspath(directory or tempfile.mkdtemp(prefix="spectra-loadtest-"))
+    paths = generate_spectra(directory, spectra, size, seed)
+    servers = list()
+    pids = [server_pid] if server_pid is not None else list()
+    urls = [url]
+    memory = list()
+    try:
+        if url is None:
+            env = os.environ
+            if workers > 1:
+                env = dict(env, SPECTRA_ANALYZER_MESSAGE_QUEUE="sqlite://" + os.path.join(directory, "queue.db"),
+                           SPECTRA_ANALYZER_STORE="sqlite://" + os.path.join(directory, "store.db"))
+            for i in range(workers):
+                servers.append(start_server(port + i, env))
+            urls = [server_url for _, server_url in servers]
+            pids = [process.pid for process, _ in servers]
+        statistics = Statistics()
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=SimulatedClient(urls[i % len(urls)], directory, paths, statistics, bursts,
+                                                           burst_size).run,
+                                    args=(deadline,), daemon=True) for i in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            if pids:
+                usage = [rss(pid) for pid in pids]
+                memory.append(None if None in usage else sum(usage))
+            time.sleep(0.5)
+        elapsed = time.perf_counter() - start
+    finally:
+        for process, _ in servers:
+            process.terminate()
+            process.wait()
+    click.echo("{} clients, {} server processes, {} spectra of {} samples, {:.1f} s".format(
+        clients, len(urls), spectra, size, elapsed))
+    statistics.report(elapsed)
+    memory = [value for value in memory if value is not None]
+    if memory:
+        click.echo("server RSS (all processes): start {:.1f} MB, peak {:.1f} MB, end {:.1f} MB".format(
+            memory[0] / 1e6, max(memory) / 1e6, memory[-1] / 1e6))
+
+
+if __name__ == "__main__":
+    main()
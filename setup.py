@@ -25,11 +25,13 @@ setup(
     entry_points={
         'console_scripts': [
             'spectra_analyzer = spectra_analyzer.server:main',
-            'spectra-analyzer = spectra_analyzer.server:main'
+            'spectra-analyzer = spectra_analyzer.server:main',
+            'spectra-index = spectra_analyzer.similarity:cli'
         ],
     },
     install_requires=['spectra_downloader', 'click', 'flask', 'eventlet', 'flask-socketio',
                       'astropy', 'numpy==1.11.2', 'matplotlib', 'scipy'],
+    extras_require={'watch': ['watchdog']},
     setup_requires=['pytest-runner'],
     tests_require=['pytest'],
 )
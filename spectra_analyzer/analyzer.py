@@ -1,11 +1,10 @@
 import os
 import io
 import base64
-from astropy.io import fits, votable
+import threading
 import numpy
-import mlpy.wavelet as wave
-import matplotlib.pyplot as plt
 import warnings
+from collections import OrderedDict
 
 
 class SpectrumFileReader:
@@ -14,24 +13,37 @@ class SpectrumFileReader:
 
     def _scidata(self, fits_file):
         """
-        This method must be overrided in subclasses. It returns pure y spectrum values
+        This method must be overrided in subclasses. It returns x and y spectrum values
         in the same way as they were written in the source spectrum file.
         :param fits_file: Path to an existing file containing spectrum data.
-        :return: 1D numpy array of y values.
+        :return: Tuple of 1D numpy arrays (x values, y values). The x values are None
+        if the format does not contain them.
         """
         pass
 
-    def normalized(self, fits_file):
+    def normalized(self, fits_file, resampling="linear", normalization="minmax"):
         """
-        Function takes spectrum file as an argument and returns y spectrum values
-        normalized to range [0, 1]
-        :param fits_file:
-        :return:
+        Function takes spectrum file as an argument and returns x spectrum values
+        resampled onto a uniform grid together with normalized y spectrum values.
+        Missing (NaN) y values are interpolated from their neighbours.
+        :param fits_file: Path to an existing file containing spectrum data.
+        :param resampling: Resampling method used for non-uniform x values (see resample function).
+        :param normalization: Name of normalization strategy from NORMALIZATIONS mapping.
+        :return: Tuple (x values or None, normalized y values).
         """
-        data = self._scidata(fits_file)
-        # normalization
-        data = (data - min(data)) / (max(data) - min(data))
-        return data
+        wavelength, data = self._scidata(fits_file)
+        # private float copy - all following steps may work in place
+        data = numpy.array(data, dtype=float)
+        if wavelength is not None:
+            valid = numpy.isfinite(wavelength)
+            if not valid.all():
+                wavelength = wavelength[valid]
+                data = data[valid]
+            fill_nan(data, wavelength)
+            wavelength, data = resample(wavelength, data, method=resampling)
+        else:
+            fill_nan(data)
+        return wavelength, normalize(data, normalization)
 
 
 class FitReader(SpectrumFileReader):
@@ -39,10 +51,17 @@ class FitReader(SpectrumFileReader):
     in the image/fits (older) standard. This standard does NOT contain x spectrum values."""
 
     def _scidata(self, file_path):
+        from astropy.io import fits
         hdulist = fits.open(file_path)
+        header = hdulist[0].header
         scidata = hdulist[0].data
         hdulist.close()
-        return scidata
+        # x values can be reconstructed only from the linear WCS keywords
+        wavelength = None
+        if "CRVAL1" in header and "CDELT1" in header:
+            pixels = numpy.arange(1, scidata.shape[0] + 1, dtype=float)
+            wavelength = header["CRVAL1"] + (pixels - header.get("CRPIX1", 1.0)) * header["CDELT1"]
+        return wavelength, scidata
 
 
 class FitsReader(SpectrumFileReader):
@@ -51,14 +70,13 @@ class FitsReader(SpectrumFileReader):
     and moreover it should also contain x spectrum values."""
 
     def _scidata(self, fits_file):
+        from astropy.io import fits
         hdulist = fits.open(fits_file)
         scidata = hdulist[1].data
-        detupled = numpy.zeros(shape=scidata.shape)
-        for i in range(scidata.shape[0]):
-            detupled[i] = scidata[i][1]
-        scidata = detupled
+        wavelength = numpy.array(scidata.field(0), dtype=float)
+        flux = numpy.array(scidata.field(1), dtype=float)
         hdulist.close()
-        return scidata
+        return wavelength, flux
 
 
 class SimpleTextReader(SpectrumFileReader):
@@ -70,8 +88,7 @@ class SimpleTextReader(SpectrumFileReader):
 
     def _scidata(self, file_path):
         s = numpy.genfromtxt(file_path, delimiter=self.separator)
-        s = s[:, 1]
-        return s
+        return s[:, 0], s[:, 1]
 
 
 class VotReader(SpectrumFileReader):
@@ -79,15 +96,27 @@ class VotReader(SpectrumFileReader):
     supported are both binary and text column based votables."""
 
     def _scidata(self, file_path):
+        from astropy.io import votable
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
             vot = votable.parse(file_path)
         table = vot.get_first_table()
         data = table.array
-        detupled = numpy.zeros(shape=data.shape)
-        for i in range(data.shape[0]):
-            detupled[i] = data[i][1]
-        return detupled
+        names = data.dtype.names
+        wavelength = numpy.ma.filled(data[names[0]].astype(float), numpy.nan)
+        flux = numpy.ma.filled(data[names[1]].astype(float), numpy.nan)
+        return wavelength, flux
+
+
+def preload():
+    """
+    Imports all heavy modules which are otherwise imported lazily on their first use
+    (astropy readers, mlpy wavelets and matplotlib). Pre-fork servers can call this
+    function in the master process so the workers do not pay the import time.
+    """
+    from astropy.io import fits, votable
+    import mlpy.wavelet
+    import matplotlib.pyplot
 
 
 EXTENSION_MAPPING = {
@@ -99,16 +128,273 @@ EXTENSION_MAPPING = {
     "txt": SimpleTextReader("\t"),
 }
 
+RESAMPLING_METHODS = ("linear", "rebin")
+DEFAULT_DJ = 0.25
+PREVIEW_POINTS = 2000
+CONTINUUM_FIT_SAMPLES = 100000
+READ_CACHE_BYTES = 64 * 2 ** 20  # total size of arrays of read spectra kept by the read cache
+
+
+def decimate(values, wavelength=None, points=PREVIEW_POINTS):
+    """
+    Decimates spectrum for plotting. Values are split into blocks and only the minimum and
+    the maximum of every block are kept, so peaks and absorption lines remain visible.
+    :param values: 1D numpy array of y spectrum values.
+    :param wavelength: X spectrum values or None if they are unknown (indices are used instead).
+    :param points: Approximate maximal number of returned samples.
+    :return: Tuple (x values, y values) of the decimated spectrum.
+    """
+    n = values.shape[0]
+    if n <= points:
+        return (numpy.arange(n) if wavelength is None else wavelength), values
+    width = -(-n // (points // 2))
+    count = n // width
+    blocks = values[:count * width].reshape(count, width)
+    offsets = numpy.arange(count) * width
+    indices = numpy.concatenate((blocks.argmin(axis=1) + offsets, blocks.argmax(axis=1) + offsets,
+                                 numpy.arange(count * width, n)))
+    indices = numpy.unique(indices)
+    return (indices if wavelength is None else wavelength[indices]), values[indices]
+
+
+def fill_nan(data, wavelength=None):
+    """
+    Replaces non-finite y values in place by linear interpolation from the nearest finite values.
+    :param data: 1D float numpy array of y spectrum values.
+    :param wavelength: Optional x spectrum values used as interpolation coordinates.
+    :return: The passed data array.
+    """
+    invalid = ~numpy.isfinite(data)
+    if not invalid.any():
+        return data
+    if invalid.all():
+        raise ValueError("Spectrum does not contain any finite value")
+    x = numpy.arange(data.shape[0]) if wavelength is None else wavelength
+    valid = ~invalid
+    xp = x[valid]
+    fp = data[valid]
+    if wavelength is not None:
+        # x values of some formats are not guaranteed to be sorted
+        order = numpy.argsort(xp, kind="mergesort")
+        xp = xp[order]
+        fp = fp[order]
+    data[invalid] = numpy.interp(x[invalid], xp, fp)
+    return data
+
+
+def normalize_minmax(data):
+    """
+    Scales y values in place to range [0, 1]. Constant spectrum is mapped to zeros.
+    :param data: 1D float numpy array without NaN values.
+    :return: The passed data array.
+    """
+    low = data.min()
+    span = data.max() - low
+    data -= low
+    if span > 0:
+        data /= span
+    return data
+
+
+def normalize_zscore(data):
+    """
+    Standardizes y values in place to zero mean and unit variance. Constant spectrum is mapped to zeros.
+    :param data: 1D float numpy array without NaN values.
+    :return: The passed data array.
+    """
+    data -= data.mean()
+    std = data.std()
+    if std > 0:
+        data /= std
+    return data
+
+
+def normalize_continuum(data, degree=3, iterations=3):
+    """
+    Divides y values in place by an estimated continuum so the continuum level is around 1.
+    The continuum is a low order polynomial fitted iteratively, points lying under the fit
+    (absorption lines) are rejected in every iteration.
+    :param data: 1D float numpy array without NaN values.
+    :param degree: Degree of the continuum polynomial.
+    :param iterations: Number of fitting iterations.
+    :return: The passed data array.
+    """
+    polynomial = numpy.polynomial.polynomial
+    x = numpy.linspace(-1.0, 1.0, data.shape[0])
+    # the continuum is smooth - fit it on a decimated spectrum only
+    step = max(1, data.shape[0] // CONTINUUM_FIT_SAMPLES)
+    xs = x[::step]
+    ys = data[::step]
+    mask = numpy.ones(xs.shape[0], dtype=bool)
+    for _ in range(iterations):
+        coefficients = polynomial.polyfit(xs[mask], ys[mask], degree)
+        residuals = ys - polynomial.polyval(xs, coefficients)
+        new_mask = residuals > -residuals[mask].std()
+        if new_mask.sum() <= degree:
+            break
+        mask = new_mask
+    continuum = polynomial.polyval(x, coefficients)
+    numpy.divide(data, continuum, out=data, where=continuum > 0)
+    return data
+
+
+NORMALIZATIONS = {
+    "minmax": normalize_minmax,
+    "zscore": normalize_zscore,
+    "continuum": normalize_continuum,
+}
+
+
+def normalize(data, strategy="minmax"):
+    """
+    Normalizes y spectrum values in place using the strategy registered in NORMALIZATIONS.
+    :param data: 1D float numpy array without NaN values.
+    :param strategy: Name of the normalization strategy.
+    :return: The passed data array.
+    """
+    function = NORMALIZATIONS.get(strategy)
+    if function is None:
+        raise ValueError("Unknown normalization strategy: {}".format(strategy))
+    return function(data)
+
+
+def _bin_edges(centers):
+    """Returns edges of bins centered on passed (increasing) x values. Outer edges are
+    placed half of the neighbouring step away from the outer centers."""
+    edges = numpy.empty(centers.shape[0] + 1)
+    edges[1:-1] = (centers[:-1] + centers[1:]) / 2
+    edges[0] = 2 * centers[0] - edges[1]
+    edges[-1] = 2 * centers[-1] - edges[-2]
+    return edges
+
+
+def resample(wavelength, flux, method="linear", size=None):
+    """
+    Resamples spectrum sampled on a possibly non-uniform wavelength grid onto a uniform grid
+    spanning the same wavelength range. Spectra which are already uniformly sampled are
+    returned unchanged.
+    :param wavelength: 1D numpy array of x spectrum values.
+    :param flux: 1D numpy array of y spectrum values.
+    :param method: Either "linear" for linear interpolation or "rebin" for flux conserving
+    rebinning computed from the cumulative sum of flux over the source bins.
+    :param size: Number of samples of the uniform grid. Implicitly the number of source samples.
+    :return: Tuple (uniform wavelength grid, resampled flux).
+    """
+    if method not in RESAMPLING_METHODS:
+        raise ValueError("Unknown resampling method: {}".format(method))
+    wavelength = numpy.asarray(wavelength, dtype=float)
+    flux = numpy.asarray(flux, dtype=float)
+    if size is None:
+        size = wavelength.shape[0]
+    if size < 2 or wavelength.shape[0] < 2:
+        return wavelength, flux
+    steps = numpy.diff(wavelength)
+    if not numpy.all(steps > 0):
+        order = numpy.argsort(wavelength, kind="mergesort")
+        wavelength = wavelength[order]
+        flux = flux[order]
+        steps = numpy.diff(wavelength)
+    if size == wavelength.shape[0] and numpy.allclose(steps, steps[0], rtol=1e-3, atol=0):
+        return wavelength, flux
+    grid = numpy.linspace(wavelength[0], wavelength[-1], size)
+    if method == "linear":
+        return grid, numpy.interp(grid, wavelength, flux)
+    # flux conserving rebinning - integrate over source bins and differentiate over target bins
+    edges = _bin_edges(wavelength)
+    cumulative = numpy.concatenate(([0.0], numpy.cumsum(flux * numpy.diff(edges))))
+    new_edges = numpy.clip(_bin_edges(grid), edges[0], edges[-1])
+    rebinned = numpy.diff(numpy.interp(new_edges, edges, cumulative)) / numpy.diff(new_edges)
+    return grid, rebinned
+
+
+class ReadCache:
+    """
+    Least recently used cache of read spectra bounded by the total size of cached arrays. It only
+    bridges repeated reads of recently used files (e.g. the preview and the transformation of one
+    analysis), transformed spectra are kept by the spectrum store.
+    """
+
+    def __init__(self, max_bytes=READ_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (wavelength or None, flux)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _nbytes(value):
+        return sum(array.nbytes for array in value if array is not None)
+
+    def get(self, key):
+        """Returns cached value of the key or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Caches the value. Least recently used values are evicted when the size exceeds the limit,
+        values larger than the limit are not cached at all."""
+        size = self._nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= self._nbytes(old)
+            self._entries[key] = value
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= self._nbytes(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+read_cache = ReadCache()
+
+
+def _read_uniform(file_path, mtime, size, resampling, normalization, cached=True):
+    """
+    Reads and resamples spectrum file. Results are cached per file in the read_cache, the modification
+    time and size arguments are part of the cache key so modified files are read again.
+    :return: Tuple (uniform wavelength grid or None, normalized flux). Returned arrays are read-only.
+    """
+    key = (file_path, mtime, size, resampling, normalization)
+    value = read_cache.get(key)
+    if value is not None:
+        return value
+    extension = file_path.split(".")[-1]
+    wavelength, flux = EXTENSION_MAPPING[extension].normalized(file_path, resampling=resampling,
+                                                               normalization=normalization)
+    for array in (wavelength, flux):
+        if array is not None:
+            array.setflags(write=False)
+    value = wavelength, flux
+    if cached:
+        read_cache.put(key, value)
+    return value
+
 
 class Spectrum:
-    @classmethod
-    def read_spectrum(cls, file_path):
+    @staticmethod
+    def read_data(file_path, resampling="linear", normalization="minmax", cached=True):
         """
-        Factory method for Spectrum class. It creates new instance of the class
-        by passing path to the spectrum file. If the reader was unable to properly
-        parse a passed spectrum this function returns None.
+        Reads spectrum file without transforming it. Spectra with non-uniform wavelength sampling
+        are resampled onto a uniform grid. If the reader was unable to properly parse a passed
+        spectrum this function returns None. Read data are cached per file, see ReadCache.
         :param file_path: Filesystem path to the spectrum file
-        :return: Spectrum instance if spectrum reading was successful. None otherwise.
+        :param resampling: Resampling method, either "linear" or "rebin" (flux conserving).
+        :param normalization: Normalization strategy, one of the NORMALIZATIONS keys.
+        :param cached: False for files which are read only once (e.g. by indexing), so they do not evict
+        recently read files from the cache.
+        :return: Tuple (wavelength or None, normalized spectrum) of read-only arrays or None.
         """
         if not os.path.isfile(file_path):
             raise ValueError("Spectrum file does not exist")
@@ -118,50 +404,154 @@ class Spectrum:
         if reader is None:
             return None
         try:
-            return cls(reader.normalized(file_path))
+            stat = os.stat(file_path)
+            return _read_uniform(os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size, resampling, normalization,
+                                 cached)
+        except Exception as ex:
+            import traceback
+            print(traceback.format_exc())
+            return None
+
+    @classmethod
+    def read_spectrum(cls, file_path, resampling="linear", normalization="minmax", dj=DEFAULT_DJ, scale_range=None,
+                      scales=None, cached=True):
+        """
+        Factory method for Spectrum class. It creates new instance of the class
+        by passing path to the spectrum file. If the reader was unable to properly
+        parse a passed spectrum this function returns None. Spectra with non-uniform
+        wavelength sampling are resampled onto a uniform grid first.
+        :param file_path: Filesystem path to the spectrum file
+        :param resampling: Resampling method, either "linear" or "rebin" (flux conserving).
+        :param normalization: Normalization strategy, one of the NORMALIZATIONS keys.
+        :param dj: Spacing between scales of the transformation, see Spectrum constructor.
+        :param scale_range: Range of computed scales, see Spectrum constructor.
+        :param scales: Explicit scales of the transformation, see Spectrum constructor.
+        :param cached: Cache the read data, see read_data method.
+        :return: Spectrum instance if spectrum reading was successful. None otherwise.
+        """
+        data = cls.read_data(file_path, resampling, normalization, cached)
+        if data is None:
+            return None
+        wavelength, spectrum = data
+        try:
+            return cls(spectrum, wavelength, dj=dj, scale_range=scale_range, scales=scales)
         except Exception as ex:
             import traceback
             print(traceback.format_exc())
             return None
 
-    def __init__(self, spectrum):
-        """Initializes instance of Spectrum class."""
+    def __init__(self, spectrum, wavelength=None, dj=DEFAULT_DJ, scale_range=None, scales=None):
+        """
+        Initializes instance of Spectrum class. The transformation is computed over all scales
+        unless scale_range is specified. In such case only the scales in the range are computed
+        and the remaining scales are computed lazily for every reduction which requires them,
+        see _reduce method. Computed scales of the instance never change, so the reduced spectrum
+        depends only on the passed arguments and transformation parameters.
+        :param spectrum: Normalized y spectrum values sampled on a uniform grid.
+        :param wavelength: Uniform grid of x spectrum values or None if they are unknown.
+        :param dj: Spacing between scales (in octaves) of automatically selected scales.
+        :param scale_range: Tuple (minimal scale, maximal scale) of computed scales in samples.
+        Any of the values can be None for an open range.
+        :param scales: Explicit increasing geometric sequence of scales in samples. Overrides dj parameter.
+        """
+        import mlpy.wavelet as wave
         self.spectrum = spectrum
-        self.scales = wave.autoscales(N=spectrum.shape[0], dt=1, dj=0.25, wf='dog', p=2)
+        self.wavelength = wavelength
+        if scales is None:
+            self.scales = wave.autoscales(N=spectrum.shape[0], dt=1, dj=dj, wf='dog', p=2)
+        else:
+            self.scales = numpy.sort(numpy.asarray(scales, dtype=float))
         self.freq0 = 0
         self.wSize = 5 if len(self.scales) > 5 else len(self.scales) - 1
-        self._transformation = wave.cwt(spectrum, dt=1, scales=self.scales, wf='dog', p=2)
         self._rec = None
+        if scale_range is None:
+            self._transformation = wave.cwt(spectrum, dt=1, scales=self.scales, wf='dog', p=2)
+            self._computed = numpy.ones(len(self.scales), dtype=bool)
+        else:
+            low, high = scale_range
+            selected = numpy.ones(len(self.scales), dtype=bool)
+            if low is not None:
+                selected &= self.scales >= low
+            if high is not None:
+                selected &= self.scales <= high
+            indices = numpy.flatnonzero(selected)
+            if len(indices) == 0:
+                # nothing in the range - start with the scale closest to the range
+                target = low if low is not None else high
+                indices = [int(numpy.argmin(numpy.abs(self.scales - target)))]
+            indices = numpy.arange(indices[0], indices[-1] + 1)
+            rows = self._cwt(indices)
+            self._transformation = numpy.zeros((len(self.scales), spectrum.shape[0]), dtype=rows.dtype)
+            self._transformation[indices] = rows
+            self._computed = numpy.zeros(len(self.scales), dtype=bool)
+            self._computed[indices] = True
+            self.freq0 = int(indices[0])
+            self.wSize = min(self.wSize, len(indices) - 1)
+
+    def _cwt(self, indices):
+        """Returns transformation rows of scales with the passed indices."""
+        import mlpy.wavelet as wave
+        return wave.cwt(self.spectrum, dt=1, scales=self.scales[indices], wf='dog', p=2)
+
+    @property
+    def computed_range(self):
+        """Tuple (first, last + 1) of indices of computed scales. Computed scales are always contiguous."""
+        computed = numpy.flatnonzero(self._computed)
+        return int(computed[0]), int(computed[-1]) + 1
 
     @staticmethod
-    def _plot_to_base64():
-        """Convert currently plotted figure into png image encoded as base64 string. Also closes figure
-        after plotting to release memory."""
+    def _plot_to_image(encoded=True):
+        """Convert currently plotted figure into png image. Also closes figure after plotting to release memory.
+        :param encoded: If True (implicit) the image is encoded as base64 string, raw png bytes are returned otherwise.
+        """
+        import matplotlib.pyplot as plt
         buf = io.BytesIO()
         plt.savefig(buf, format="png")
-        buf.seek(0)
-        img = base64.b64encode(buf.getvalue()).decode("ascii")
+        img = buf.getvalue()
         buf.close()
         plt.close()
+        if encoded:
+            img = base64.b64encode(img).decode("ascii")
         return img
 
-    def _recount_rec(self):
-        """This method recounts reduced spectrum and saves it as an instance attribute."""
+    def _plot_args(self, values):
+        """Returns arguments for plotting passed y values against x spectrum values if they are known."""
+        if self.wavelength is None:
+            return values,
+        return self.wavelength, values
+
+    def _reduce(self, freq0, wSize):
+        """
+        Returns normalized spectrum reconstructed from the transformation without scales in
+        the window [freq0, freq0 + wSize). Parameters must be already adjusted to the boundaries.
+        If the window lies outside the computed scales, scales between them are computed into
+        a temporary transformation, the instance is never modified. Scales outside both
+        the computed range and the window do not contribute to the reduced spectrum.
+        """
+        import mlpy.wavelet as wave
+        start, stop = self.computed_range
+        transformation = self._transformation.copy()
+        transformation[freq0:freq0 + wSize] = 0
+        missing = [i for i in range(min(start, freq0), max(stop, freq0 + wSize))
+                   if not self._computed[i] and not freq0 <= i < freq0 + wSize]
+        if missing:
+            transformation[missing] = self._cwt(missing)
         # do "dog" wavelet transformation
-        concatenated = numpy.concatenate((
-            self._transformation[:self.freq0], numpy.zeros((self.wSize, len(self.spectrum))),
-            self._transformation[self.freq0 + self.wSize:]))
-        self._rec = wave.icwt(concatenated, dt=1, scales=self.scales, wf='dog', p=2)
+        rec = wave.icwt(transformation, dt=1, scales=self.scales, wf='dog', p=2)
         # normalize
-        self._rec = (self._rec - min(self._rec)) / (max(self._rec) - min(self._rec))
+        return normalize_minmax(rec)
 
-    def modify_parameters(self, freq0, wSize):
+    def _recount_rec(self):
+        """This method recounts reduced spectrum and saves it as an instance attribute."""
+        self._rec = self._reduce(self.freq0, self.wSize)
+
+    def adjust_parameters(self, freq0, wSize):
         """
-        This method modifies transformation parameters saved in the class. It also
-        provides boundary checks. If parameters are out of boundary, wSize parameter is adjusted to
-        match correct settings.
+        Provides boundary checks of transformation parameters. If parameters are out of boundary,
+        wSize parameter is adjusted to match correct settings.
         :param freq0: Frequency shift parameter. This parameter bust be in range [0, len(scales) - 1 - wSize].
         :param wSize: Window size parameter. This parameter must be in range [0, len(scales) - 1 - freq0].
+        :return: Tuple of adjusted parameters (freq0, wSize).
         """
         sl = len(self.scales)
         if freq0 < 0:
@@ -173,41 +563,87 @@ class Spectrum:
         elif wSize >= sl - freq0:
             wSize = sl - 1 - freq0
             wSize = 0 if wSize < 0 else wSize
-        self.freq0 = freq0
-        self.wSize = wSize
+        return freq0, wSize
+
+    def modify_parameters(self, freq0, wSize):
+        """
+        This method modifies transformation parameters saved in the class. It also
+        provides boundary checks (see adjust_parameters method).
+        :param freq0: Frequency shift parameter. This parameter bust be in range [0, len(scales) - 1 - wSize].
+        :param wSize: Window size parameter. This parameter must be in range [0, len(scales) - 1 - freq0].
+        """
+        self.freq0, self.wSize = self.adjust_parameters(freq0, wSize)
         # invalidate _rec
         self._rec = None
 
-    def plot_spectrum(self):
+    def reduced_spectrum(self, freq0=None, wSize=None):
+        """
+        Returns reduced spectrum. If any of the parameters is passed, the reduction is computed
+        for the passed parameters without modifying parameters saved in the instance.
+        :param freq0: Frequency shift parameter. Saved parameter is used if None.
+        :param wSize: Window size parameter. Saved parameter is used if None.
+        :return: 1D numpy array of reduced spectrum values normalized to range [0, 1].
+        """
+        if freq0 is None and wSize is None:
+            if self._rec is None:
+                self._recount_rec()
+            return self._rec
+        freq0 = self.freq0 if freq0 is None else freq0
+        wSize = self.wSize if wSize is None else wSize
+        return self._reduce(*self.adjust_parameters(freq0, wSize))
+
+    @classmethod
+    def plot_preview(cls, spectrum, wavelength=None, encoded=True):
+        """
+        Returns quickly plotted spectrum which has not been transformed yet. The spectrum is decimated
+        before plotting, see decimate function.
+        :param spectrum: Normalized y spectrum values.
+        :param wavelength: X spectrum values or None if they are unknown.
+        :param encoded: If set as False, raw png bytes are returned instead.
+        :return: PNG image encoded as Base64 string.
+        """
+        import matplotlib.pyplot as plt
+        plt.figure(figsize=(15, 2))
+        plt.plot(*decimate(spectrum, wavelength))
+        return cls._plot_to_image(encoded)
+
+    def plot_spectrum(self, encoded=True):
         """
         Returns plotted spectrum as a png image encoded in base64 format.
+        :param encoded: If set as False, raw png bytes are returned instead.
         :return: PNG image encoded as Base64 string.
         """
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(15, 2))
-        plt.plot(self.spectrum)
-        return self._plot_to_base64()
+        plt.plot(*self._plot_args(self.spectrum))
+        return self._plot_to_image(encoded)
 
-    def plot_cwt(self):
+    def plot_cwt(self, encoded=True):
         """
         Returns image representation of continuous wavelet transformation.
+        :param encoded: If set as False, raw png bytes are returned instead.
         :return: PNG image encoded as Base64 string.
         """
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(15, 2))
         plt.imshow(numpy.abs(self._transformation), aspect="auto")
-        return self._plot_to_base64()
+        return self._plot_to_image(encoded)
 
-    def plot_reduced_spectrum(self, only_transformation=False):
+    def plot_reduced_spectrum(self, only_transformation=False, freq0=None, wSize=None, encoded=True):
         """
         Do a wavelet transformation - dimension reduction method. Returns a png image of
         the spectrum before and after transformation encoded in base64 format.
         :param only_transformation: Specifies, that only transformation graph should be plotted.
         If set as False (implicit) both graph (old and new spectrum) are plotted.
+        :param freq0: Frequency shift parameter, see reduced_spectrum method.
+        :param wSize: Window size parameter, see reduced_spectrum method.
+        :param encoded: If set as False, raw png bytes are returned instead.
         :return: PNG image encoded as Base64 string.
         """
-        if self._rec is None:
-            self._recount_rec()
+        import matplotlib.pyplot as plt
+        rec = self.reduced_spectrum(freq0, wSize)
         plt.figure(figsize=(15, 5))
-        plt.plot(self._rec)
+        plt.plot(*self._plot_args(rec))
         if not only_transformation:
-            plt.plot(self.spectrum, alpha=0.8)
-        return self._plot_to_base64()
+            plt.plot(*self._plot_args(self.spectrum), alpha=0.8)
+        return self._plot_to_image(encoded)
@@ -0,0 +1,120 @@
+import os
+import hashlib
+import sqlite3
+import functools
+import threading
+
+CONTENT_INDEX = ".spectra_content.db"
+HASH_CHUNK_SIZE = 1 << 20
+
+
+@functools.lru_cache(maxsize=4096)
+def _cached_hash(path, mtime, size, inode):
+    """Computes SHA-256 of the file content. Results are cached, file modification time, size
+    and inode are part of the cache key so modified or replaced files are hashed again."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_hash(file_path):
+    """
+    Returns hash of the file content. The file is read in chunks so memory consumption does not
+    depend on the file size and hashes of unmodified files are not computed repeatedly.
+    :param file_path: Filesystem path to an existing file.
+    :return: Hexadecimal SHA-256 digest.
+    """
+    path = os.path.abspath(file_path)
+    stat = os.stat(path)
+    return _cached_hash(path, stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class ContentIndex:
+    """
+    Content addressed index of spectra in one download directory. It maps content hashes to
+    canonical files and remote identifiers (download URLs or spectra names) to content hashes,
+    so spectra already present in the directory need not be downloaded again and duplicates
+    downloaded under different names do not occupy disk space. Index is stored in the SQLite
+    database CONTENT_INDEX inside the directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self._connection = sqlite3.connect(os.path.join(self.directory, CONTENT_INDEX), timeout=30,
+                                           isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS files (hash TEXT PRIMARY KEY, path TEXT NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS remote "
+                                     "(identifier TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+
+    def close(self):
+        self._connection.close()
+
+    def canonical(self, digest):
+        """
+        Returns canonical file with the passed content hash. Canonical files which were removed
+        or modified since they were registered are dropped from the index.
+        :param digest: Content hash, see content_hash function.
+        :return: Absolute path to the canonical file or None if no such file is known.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT path FROM files WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            return None
+        path = row[0]
+        try:
+            valid = content_hash(path) == digest
+        except OSError:
+            valid = False
+        if not valid:
+            with self._lock:
+                self._connection.execute("DELETE FROM files WHERE hash = ? AND path = ?", (digest, path))
+            return None
+        return path
+
+    def known_remote(self, identifier):
+        """
+        Returns canonical file of a remote spectrum if it has already been downloaded.
+        :param identifier: Remote identifier of the spectrum.
+        :return: Absolute path to the canonical file or None if the spectrum is not known.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT hash FROM remote WHERE identifier = ?", (identifier,)).fetchone()
+        return None if row is None else self.canonical(row[0])
+
+    def register(self, file_path, identifiers=()):
+        """
+        Registers downloaded file. If a file with the same content is already known, the passed file
+        is replaced by a hard link to the canonical file (if the filesystem supports it).
+        :param file_path: Path to the downloaded file.
+        :param identifiers: Remote identifiers of the file.
+        :return: Tuple (content hash, absolute path to the canonical file).
+        """
+        path = os.path.abspath(file_path)
+        digest = content_hash(path)
+        canonical = self.canonical(digest)
+        if canonical is None:
+            canonical = path
+            with self._lock:
+                self._connection.execute("INSERT OR REPLACE INTO files (hash, path) VALUES (?, ?)", (digest, path))
+        elif not os.path.samefile(canonical, path):
+            _link_duplicate(canonical, path)
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO remote (identifier, hash) VALUES (?, ?)",
+                                         [(identifier, digest) for identifier in identifiers])
+        return digest, canonical
+
+
+def _link_duplicate(canonical, path):
+    """Replaces duplicate file by a hard link to the canonical file. The duplicate is kept
+    if hard links are not supported."""
+    tmp = path + ".link"
+    try:
+        os.link(canonical, tmp)
+    except OSError:
+        return
+    os.replace(tmp, path)
@@ -0,0 +1,103 @@
+import os
+import time
+import pickle
+import sqlite3
+import threading
+import socketio
+
+POLL_INTERVAL = 0.05  # period of polling the queue for new messages in seconds
+RETENTION = 60  # lifetime of published messages in seconds
+
+
+class SqliteManager(socketio.PubSubManager):
+    """
+    Client manager of the socketio server passing messages between worker processes through
+    a SQLite database file. It is a local stand-in for message queue services (redis, RabbitMQ)
+    for tests and single host deployments - all workers must share the database file. Messages
+    are polled, so they are delivered with a delay of up to POLL_INTERVAL seconds.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path, channel="socketio", write_only=False, logger=None, poll_interval=POLL_INTERVAL):
+        """
+        Opens the queue. Only messages published after opening are delivered.
+        :param path: Path to the database file, it is created if it does not exist.
+        :param channel: Name of the channel shared by the workers.
+        :param write_only: True for processes which only emit messages (they do not serve clients).
+        :param logger: Logger of the manager, see socketio.PubSubManager.
+        :param poll_interval: Period of polling the queue for new messages in seconds.
+        """
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        with self._lock:
+            connection = self._connect()
+            connection.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                               "channel TEXT NOT NULL, data BLOB NOT NULL, created REAL NOT NULL)")
+            self._position = connection.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+
+    def _connect(self):
+        """Returns connection to the database. Connections are not shared with forked processes.
+        Must be called with the lock acquired."""
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                               check_same_thread=False)
+            self._pid = os.getpid()
+        return self._connection
+
+    def _publish(self, data):
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("INSERT INTO messages (channel, data, created) VALUES (?, ?, ?)",
+                               (self.channel, sqlite3.Binary(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)),
+                                now))
+            connection.execute("DELETE FROM messages WHERE created < ?", (now - RETENTION,))
+
+    def _fetch(self):
+        """Returns messages published since the last fetch."""
+        with self._lock:
+            rows = self._connect().execute("SELECT id, data FROM messages WHERE id > ? AND channel = ? ORDER BY id",
+                                           (self._position, self.channel)).fetchall()
+        if rows:
+            self._position = rows[-1][0]
+        return [pickle.loads(data) for _, data in rows]
+
+    def _sleep(self):
+        if self.server is not None:
+            self.server.sleep(self.poll_interval)
+        else:
+            time.sleep(self.poll_interval)
+
+    def _listen(self):
+        while True:
+            try:
+                messages = self._fetch()
+            except sqlite3.Error:
+                messages = list()  # database is locked or temporarily unavailable, try again later
+            for message in messages:
+                yield message
+            if not messages:
+                self._sleep()
+
+
+def queue_options(url):
+    """
+    Returns options of the SocketIO server for the message queue URL. Supported URLs are
+    sqlite:///path/to/queue.db (see SqliteManager) and URLs of message queue services
+    supported by Flask-SocketIO (e.g. redis://localhost:6379/0).
+    :param url: Message queue URL or None for a single process deployment.
+    :return: Dictionary of keyword arguments of the SocketIO constructor.
+    """
+    if not url:
+        return dict()
+    if url.startswith("sqlite://"):
+        path = url[len("sqlite://"):]
+        if not path:
+            raise ValueError("SQLite message queue URL must contain a database path")
+        return {"client_manager": SqliteManager(path)}
+    return {"message_queue": url}
@@ -1,13 +1,48 @@
-from flask import Flask, render_template, session, request, redirect, url_for
-from flask_socketio import SocketIO, emit
-from spectra_downloader import SpectraDownloader
-from .analyzer import Spectrum
 import os
+
+# multi-worker deployments must share the message queue (e.g. redis://host:6379/0 or sqlite:///path/queue.db)
+# and the spectrum store
+MESSAGE_QUEUE = os.environ.get("SPECTRA_ANALYZER_MESSAGE_QUEUE")
+ASYNC_MODE = None  # detected by Flask-SocketIO
+if MESSAGE_QUEUE:
+    # message queue listener blocks the event loop unless the standard library is monkey patched,
+    # which must happen before anything else is imported
+    try:
+        import eventlet
+        eventlet.monkey_patch()
+        ASYNC_MODE = "eventlet"
+    except ImportError:
+        ASYNC_MODE = "threading"
+
+from flask import Flask, render_template, session, request, redirect, url_for, jsonify, Response
+from flask_socketio import SocketIO, emit
+from .analyzer import Spectrum, EXTENSION_MAPPING, DEFAULT_DJ, preload as preload_analyzer
+from .store import create_store, file_key
+from .similarity import SpectraIndex
+from .dedup import ContentIndex
+from .watcher import DirectoryWatcher
+from .messaging import queue_options
+import io
+import json
 import time
+import hashlib
+import threading
 import urllib
 import click
+import numpy
 
 DEFAULT_DIRECTORY = "/tmp/spectra"
+STORE_URL = os.environ.get("SPECTRA_ANALYZER_STORE", "memory://")
+PROGRESS_INTERVAL = 0.25  # maximal delay between two download progress messages in seconds
+PROGRESS_BATCH = 200  # maximal number of downloaded spectra aggregated into one progress message
+API_MAX_AGE = 3600  # lifetime of analysis API responses in caches in seconds
+WATCH_INTERVAL = 0.25  # period of polling watchers with filesystem notifications in seconds
+WATCH_POLL_INTERVAL = 2.0  # period of scanning watched directories without filesystem notifications in seconds
+PRECOMPUTE_SHARE = 0.5  # maximal share of the spectrum store capacity used by queued precomputations
+INDEX_UPDATE_INTERVAL = 60  # minimal period of similarity index updates of one directory in seconds
+INDEX_WAIT_INTERVAL = 0.5  # period of checking whether another task has finished building of an index in seconds
+API_KINDS = ("spectrum", "cwt", "reduced")
+API_FORMATS = {"png": "image/png", "npy": "application/octet-stream", "json": "application/json"}
 
 
 class MyFlask(Flask):
@@ -26,7 +61,17 @@ class MyFlask(Flask):
 
 app = MyFlask(__name__)
 app.config['SECRET_KEY'] = 'sometotalbrutalsecret'
-socketio = SocketIO(app, path='/spectra-analyzer/socket.io')
+socketio = SocketIO(app, path='/spectra-analyzer/socket.io', async_mode=ASYNC_MODE, **queue_options(MESSAGE_QUEUE))
+spectrum_store = create_store(STORE_URL)
+watchers = dict()  # directory path -> watcher shared by all clients listing the directory
+subscriptions = dict()  # client's connection identifier -> path to the watched directory listed by the client
+watch_lock = threading.Lock()
+analyses = dict()  # tokens of the latest analyses requested by connected analyzer clients
+precompute_pending = set()  # spectra files queued for background precomputation
+precompute_lock = threading.Lock()
+index_updating = set()  # directories with running similarity index updates
+index_updated = dict()  # directory -> monotonic time of the last started similarity index update
+index_lock = threading.Lock()
 
 
 # flask route specification
@@ -60,6 +105,163 @@ def page_not_found(error):
     return redirect(url_for('index'))
 
 
+def analysis_options(data):
+    """
+    Returns transformation options of Spectrum parsed from the client's request data.
+    :param data: Dictionary like object with optional dj, min_scale and max_scale items.
+    :return: Dictionary with dj and scale_range items.
+    :raises ValueError: If the options are not numbers.
+    """
+    dj = float(data.get("dj", DEFAULT_DJ))
+    low = data.get("min_scale")
+    high = data.get("max_scale")
+    if dj <= 0:
+        raise ValueError("Parameter dj must be positive")
+    if low is None and high is None:
+        return {"dj": dj, "scale_range": None}
+    return {"dj": dj, "scale_range": (None if low is None else float(low), None if high is None else float(high))}
+
+
+def transformation_parameters(data):
+    """
+    Returns transformation parameters parsed from the client's request data.
+    :param data: Dictionary like object with optional freq0 and wSize items.
+    :return: Tuple (freq0, wSize), omitted parameters are None.
+    :raises ValueError: If the parameters are not integers.
+    """
+    parameters = list()
+    for name in ("freq0", "wSize"):
+        value = data.get(name)
+        try:
+            parameters.append(None if value is None else int(value))
+        except ValueError:
+            raise ValueError("Parameter {} must be an integer".format(name))
+    return tuple(parameters)
+
+
+def load_spectrum(file_path, dj=DEFAULT_DJ, scale_range=None):
+    """
+    Returns transformed spectrum from the shared spectrum store. Spectrum is read and stored
+    if it is not present in the store yet. Returned instance is shared by all clients and
+    must not be modified, transformation parameters are kept in client sessions instead.
+    :param file_path: Path to the spectrum file.
+    :param dj: Spacing between scales, see Spectrum constructor.
+    :param scale_range: Range of initially computed scales, see Spectrum constructor.
+    :return: Spectrum instance or None if the file is not a valid spectrum.
+    """
+    if not os.path.isfile(file_path):
+        return None
+    key = file_key(file_path)
+    if dj != DEFAULT_DJ or scale_range is not None:
+        scale_range = None if scale_range is None else tuple(scale_range)
+        key = "{}|{}|{}".format(key, dj, scale_range)
+    spectrum = spectrum_store.get(key)
+    if spectrum is None:
+        spectrum = Spectrum.read_spectrum(file_path, dj=dj, scale_range=scale_range)
+        if spectrum is not None:
+            spectrum_store.put(key, spectrum)
+    return spectrum
+
+
+def api_error(message, status):
+    """Returns JSON formatted error response of analysis API."""
+    response = jsonify({"error": message})
+    response.status_code = status
+    return response
+
+
+def api_etag(path, stat, arguments):
+    """
+    Returns entity tag of analysis API response. The tag is derived from the file
+    identity and modification time and from all request parameters.
+    :param path: Absolute path to the spectrum file.
+    :param stat: Result of os.stat for the spectrum file.
+    :param arguments: Sequence of request parameters determining the response.
+    :return: Entity tag string.
+    """
+    key = "|".join(map(str, (path, stat.st_mtime_ns, stat.st_size) + tuple(arguments)))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def api_data(spectrum, kind, freq0, wSize):
+    """Returns numpy array of the requested analysis result."""
+    if kind == "spectrum":
+        return spectrum.spectrum
+    if kind == "cwt":
+        return numpy.abs(spectrum._transformation)
+    return spectrum.reduced_spectrum(freq0, wSize)
+
+
+@app.route("/api/spectrum")
+def api_spectrum():
+    """
+    Stateless HTTP analysis API. Spectrum file is specified by the path query parameter,
+    transformation parameters by freq0 and wSize parameters (spectrum defaults if omitted).
+    Parameter kind selects the result (spectrum, cwt or reduced) and parameter format selects
+    the representation (png, npy or json). Parameters dj, min_scale and max_scale limit the
+    computed scales of the transformation (see Spectrum constructor). Responses carry an ETag and Cache-Control headers
+    and conditional requests are answered with 304 without recomputing the analysis.
+    """
+    path = request.args.get("path")
+    if path is None:
+        return api_error("Parameter path is required", 400)
+    path = os.path.abspath(path)
+    if not os.path.isfile(path):
+        return api_error("Spectrum file does not exist", 404)
+    kind = request.args.get("kind", "reduced")
+    fmt = request.args.get("format", "png")
+    if kind not in API_KINDS:
+        return api_error("Parameter kind must be one of: {}".format(", ".join(API_KINDS)), 400)
+    if fmt not in API_FORMATS:
+        return api_error("Parameter format must be one of: {}".format(", ".join(API_FORMATS)), 400)
+    only_transformation = request.args.get("only-transformation", "false").lower() in ("1", "true")
+    try:
+        freq0, wSize = transformation_parameters(request.args)
+        options = analysis_options(request.args)
+    except ValueError as ex:
+        return api_error(str(ex), 400)
+    stat = os.stat(path)
+    etag = api_etag(path, stat, (kind, fmt, freq0, wSize, only_transformation, options["dj"],
+                                 options["scale_range"]))
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        spectrum = load_spectrum(path, **options)
+        if spectrum is None:
+            return api_error("Spectrum file has invalid format", 422)
+        if fmt == "png":
+            if kind == "spectrum":
+                body = spectrum.plot_spectrum(encoded=False)
+            elif kind == "cwt":
+                body = spectrum.plot_cwt(encoded=False)
+            else:
+                body = spectrum.plot_reduced_spectrum(only_transformation, freq0, wSize, encoded=False)
+        elif fmt == "npy":
+            buf = io.BytesIO()
+            numpy.save(buf, api_data(spectrum, kind, freq0, wSize))
+            body = buf.getvalue()
+        else:
+            freq0, wSize = spectrum.adjust_parameters(spectrum.freq0 if freq0 is None else freq0,
+                                                      spectrum.wSize if wSize is None else wSize)
+            wavelength = spectrum.wavelength
+            body = json.dumps({
+                "file_name": os.path.basename(path),
+                "kind": kind,
+                "freq0": freq0,
+                "wSize": wSize,
+                "scales": len(spectrum.scales),
+                "computed": spectrum.computed_range,
+                "wavelength": None if wavelength is None else wavelength.tolist(),
+                "values": api_data(spectrum, kind, freq0, wSize).tolist()
+            })
+        response = Response(body, mimetype=API_FORMATS[fmt])
+    response.set_etag(etag)
+    response.last_modified = stat.st_mtime
+    response.cache_control.public = True
+    response.cache_control.max_age = API_MAX_AGE
+    return response
+
+
 @socketio.on("votable_text", namespace="/downloader")
 def votable_text(message):
     """
@@ -92,6 +294,7 @@ def process_vot(url=None, votable=None):
     """
     if url is None and votable is None:
         raise ValueError("Either link or votable argument must be provided.")
+    from spectra_downloader import SpectraDownloader
     try:
         if url is not None:
             spectra_downloader = SpectraDownloader.from_link(url)
@@ -163,53 +366,162 @@ def download_spectra(message):
     # save directory into session
     session["directory"] = directory
     spectra = list(map(lambda i: spectra_downloader.parsed_ssap.rows[int(i)], spectra_ids))
+    datalink = None
+    suffix = ""
     if use_datalink:
         datalink = message.get('datalink')
         if datalink is None:
             return redirect(url_for('downloader'))
-        socketio.start_background_task(spectra_downloader.download_datalink, spectra, datalink, directory,
-                                       progress_callback=download_progress(request.sid),
-                                       done_callback=download_finished(request.sid), async=False)
+        # the same spectrum with different DataLink options is a different remote resource
+        suffix = "?" + urllib.parse.urlencode(sorted(datalink.items()))
+    # skip spectra which have already been downloaded into the directory
+    content_index = ContentIndex(directory)
+    identifiers = dict()
+    pending = list()
+    for spectrum in spectra:
+        refname = spectra_downloader.parsed_ssap.get_refname(spectrum)
+        if content_index.known_remote(refname + suffix) is None:
+            identifiers[refname] = refname + suffix
+            pending.append(spectrum)
+    progress = DownloadProgress(request.sid, directory, len(spectra), content_index=content_index,
+                                identifiers=identifiers, skipped=len(spectra) - len(pending))
+    if len(pending) == 0:
+        progress.finish(True)
+        return
+    # "async" is a reserved word since Python 3.7 so the keyword argument must be unpacked
+    options = {"progress_callback": progress.add, "done_callback": progress.finish, "async": False}
+    if use_datalink:
+        socketio.start_background_task(spectra_downloader.download_datalink, pending, datalink, directory,
+                                       **options)
     else:
-        socketio.start_background_task(spectra_downloader.download_direct, spectra, directory,
-                                       progress_callback=download_progress(request.sid),
-                                       done_callback=download_finished(request.sid), async=False)
-
-
-def download_progress(sid):
-    """
-    This function serves as a factory for progress callbacks. These callbacks
-    are created when clients initiates spectra downloading and they want to be
-    informed about progress.
-    :param sid: Client's socketio connection identifier.
-    :return: Callback method taking argument by the spectra-downloader specification.
-    """
-
-    def callback(result):
-        message = dict()
-        message["file_name"] = result.name
-        message["url"] = result.url
-        message["success"] = result.success
-        if not result.success:
-            message["exception"] = str(result.exception)
-        socketio.emit("spectrum_downloaded", message, namespace="/downloader", room=sid)
-        socketio.sleep()  # this is necessary to force flush message
+        socketio.start_background_task(spectra_downloader.download_direct, pending, directory, **options)
 
-    return callback
 
-
-def download_finished(sid):
+class DownloadProgress:
     """
-    This function serves as a factory for done callbacks. These callbacks are
-    used to signalize client that the spectra downloading process has finished.
-    :param sid: Client's socketio connection identifier.
-    :return: Callback method taking one boolean argument signalizing success.
+    Aggregates results of individual spectra downloads and informs the client about the
+    progress in periodic batched messages instead of sending one message per spectrum.
+    Batched message contains counters, byte totals and throughput. Detailed entries are
+    sent only for failed downloads. Downloaded files are registered in the content index
+    of the directory so duplicates are detected.
     """
 
-    def callback(success):
-        socketio.emit("spectra_downloaded", success, namespace="/downloader", room=sid)
-
-    return callback
+    def __init__(self, sid, directory, total, content_index=None, identifiers=None, skipped=0,
+                 interval=PROGRESS_INTERVAL, batch=PROGRESS_BATCH):
+        """
+        Initializes progress aggregator for one downloading process.
+        :param sid: Client's socketio connection identifier.
+        :param directory: Target directory of downloaded spectra used for counting downloaded bytes.
+        :param total: Number of spectra selected for downloading (including skipped ones).
+        :param content_index: ContentIndex of the directory or None if downloads should not be registered.
+        :param identifiers: Mapping of spectra names to their remote identifiers.
+        :param skipped: Number of spectra skipped because they had been already downloaded.
+        :param interval: Maximal delay in seconds between two progress messages.
+        :param batch: Maximal number of results aggregated into one progress message.
+        """
+        self.sid = sid
+        self.directory = directory
+        self.total = total
+        self.content_index = content_index
+        self.identifiers = identifiers or dict()
+        self.skipped = skipped
+        self.interval = interval
+        self.batch = batch
+        self.downloaded = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.bytes = 0
+        self._started = time.monotonic()
+        self._last_flush = self._started
+        self._pending = 0
+        self._failures = list()
+        self._lock = threading.Lock()
+
+    def _register(self, result):
+        """Registers downloaded file in the content index. Returns size of the downloaded file (zero
+        if the file cannot be found) and flag signalizing that the file duplicates an older one."""
+        try:
+            path = os.path.join(self.directory, result.name)
+            size = os.path.getsize(path)
+        except (OSError, TypeError):
+            return 0, False
+        if self.content_index is None:
+            return size, False
+        identifiers = [result.url]
+        if result.name in self.identifiers:
+            identifiers.append(self.identifiers[result.name])
+        try:
+            _, canonical = self.content_index.register(path, identifiers)
+        except OSError:
+            return size, False
+        return size, canonical != os.path.abspath(path)
+
+    def _message(self, now):
+        """Creates progress message from the aggregated results and resets pending failures.
+        Must be called with the lock acquired."""
+        elapsed = now - self._started
+        message = {
+            "downloaded": self.downloaded,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "duplicates": self.duplicates,
+            "total": self.total,
+            "bytes": self.bytes,
+            "size": format_size(self.bytes),
+            "elapsed": elapsed,
+            "files_per_second": (self.downloaded + self.failed) / elapsed if elapsed > 0 else 0.0,
+            "bytes_per_second": self.bytes / elapsed if elapsed > 0 else 0.0,
+            "failures": self._failures
+        }
+        self._failures = list()
+        self._pending = 0
+        self._last_flush = now
+        return message
+
+    def _emit(self, message):
+        socketio.emit("download_progress", message, namespace="/downloader", room=self.sid)
+        # give the server a chance to send the batch - once per batch instead of once per spectrum
+        socketio.sleep()
+
+    def add(self, result):
+        """
+        Progress callback taking argument by the spectra-downloader specification. Result is
+        aggregated and the progress message is emitted only if the batch is full or if the
+        interval since the last message has elapsed.
+        :param result: Result of one spectrum download.
+        """
+        size, duplicate = self._register(result) if result.success else (0, False)
+        with self._lock:
+            self._pending += 1
+            if result.success:
+                self.downloaded += 1
+                self.duplicates += duplicate
+                self.bytes += size
+            else:
+                self.failed += 1
+                self._failures.append({
+                    "file_name": result.name,
+                    "url": result.url,
+                    "exception": str(result.exception)
+                })
+            now = time.monotonic()
+            if self._pending < self.batch and now - self._last_flush < self.interval:
+                return
+            message = self._message(now)
+        self._emit(message)
+
+    def finish(self, success):
+        """
+        Done callback taking one boolean argument signalizing success. Remaining aggregated
+        results are flushed and the client is informed that downloading has finished.
+        :param success: True if all spectra were downloaded successfully.
+        """
+        with self._lock:
+            message = self._message(time.monotonic())
+        if self.content_index is not None:
+            self.content_index.close()
+        socketio.emit("download_progress", message, namespace="/downloader", room=self.sid)
+        socketio.emit("spectra_downloaded", success, namespace="/downloader", room=self.sid)
 
 
 @socketio.on("connect", namespace="/downloader")
@@ -259,6 +571,30 @@ def format_mtime(mtime):
     return time.strftime("%H:%M:%S %d. %m. %Y", time.localtime(mtime))
 
 
+def serialize_entry(path, selected=None):
+    """
+    Returns json serializable object representing one directory entry in the listing.
+    :param path: Absolute filesystem path of the entry.
+    :param selected: Name of file that should be marked as a selected one.
+    :return: Serializable dictionary or None if the entry is neither a directory nor a file.
+    """
+    name = os.path.basename(path)
+    if os.path.isdir(path):
+        return {"is_file": False, "name": name, "path": path}
+    elif os.path.isfile(path):
+        size = format_size(os.path.getsize(path))
+        mtime = format_mtime(os.path.getmtime(path))
+        return {
+            "is_file": True,
+            "name": name,
+            "path": path,
+            "size": size,
+            "modified": mtime,
+            "selected": selected == name
+        }
+    return None
+
+
 def serialize_path(path, selected=None):
     """
     Returns json serializable object that can be sent to the client. This object
@@ -277,20 +613,13 @@ def serialize_path(path, selected=None):
         # append .. path
         dirs.append({"is_file": False, "name": "..", "path": os.path.dirname(path)})
         for name in os.listdir(path):
-            new_path = os.path.join(path, name)
-            if os.path.isdir(new_path):
-                dirs.append({"is_file": False, "name": name, "path": new_path})
-            elif os.path.isfile(new_path):
-                size = format_size(os.path.getsize(new_path))
-                mtime = format_mtime(os.path.getmtime(new_path))
-                files.append({
-                    "is_file": True,
-                    "name": name,
-                    "path": new_path,
-                    "size": size,
-                    "modified": mtime,
-                    "selected": selected == name
-                })
+            entry = serialize_entry(os.path.join(path, name), selected)
+            if entry is None:
+                continue
+            if entry["is_file"]:
+                files.append(entry)
+            else:
+                dirs.append(entry)
         return {"path": path, "invalid": False, "directory": dirs + files}
     elif os.path.isfile(path):
         return serialize_path(*os.path.split(path))
@@ -298,6 +627,122 @@ def serialize_path(path, selected=None):
         return {"path": path, "invalid": True}
 
 
+def serialize_delta(path, added, modified, removed):
+    """
+    Returns json serializable object describing changes of a watched directory since
+    the last listing. Entries have the same format as entries of serialize_path listing.
+    :param path: Absolute path to the directory.
+    :param added: Names of added entries.
+    :param modified: Names of modified entries.
+    :param removed: Names of removed entries.
+    :return: Serializable dictionary.
+    """
+    def entries(names):
+        serialized = (serialize_entry(os.path.join(path, name)) for name in names)
+        return [entry for entry in serialized if entry is not None]
+
+    return {
+        "path": path,
+        "added": entries(added),
+        "modified": entries(modified),
+        "removed": [os.path.join(path, name) for name in removed]
+    }
+
+
+def precompute(file_paths):
+    """
+    Background task reading and transforming passed spectra files into the spectrum store
+    so they are analyzed instantly when the client selects them.
+    :param file_paths: Paths to spectra files.
+    """
+    try:
+        for file_path in file_paths:
+            try:
+                load_spectrum(file_path)
+            except (OSError, ValueError):
+                pass  # file has been removed in the meantime
+            with precompute_lock:
+                precompute_pending.discard(file_path)
+            socketio.sleep()  # let other clients be served between spectra
+    finally:
+        # unprocessed files of a failed task must not occupy the precomputation budget
+        with precompute_lock:
+            precompute_pending.difference_update(file_paths)
+
+
+def schedule_precompute(path, names):
+    """Queues spectra files among the passed entries of the directory for background precomputation.
+    Files which are already queued are skipped. Precomputed spectra must not evict spectra analyzed
+    by clients from the spectrum store, so files exceeding the PRECOMPUTE_SHARE of the store capacity
+    are skipped (they are analyzed once selected)."""
+    limit = int(spectrum_store.max_entries * PRECOMPUTE_SHARE)
+    file_paths = list()
+    with precompute_lock:
+        for name in names:
+            if len(precompute_pending) >= limit:
+                break
+            file_path = os.path.join(path, name)
+            if name.split(".")[-1] in EXTENSION_MAPPING and file_path not in precompute_pending:
+                precompute_pending.add(file_path)
+                file_paths.append(file_path)
+    if file_paths:
+        socketio.start_background_task(precompute, file_paths)
+
+
+def watch_directory(sid, path):
+    """
+    Subscribes the client to changes of the listed directory. Previous subscription of the client
+    is cancelled. Every directory is watched by one watcher shared by all subscribed clients.
+    Changes of the directory are sent as incremental directory_delta messages and new or modified
+    spectra are precomputed in the background.
+    :param sid: Client's socketio connection identifier.
+    :param path: Path to the listed directory.
+    """
+    unwatch_directory(sid)
+    path = os.path.abspath(path)
+    with watch_lock:
+        subscriptions[sid] = path
+        if path in watchers:
+            return
+        watcher = watchers[path] = DirectoryWatcher(path)
+
+    def watch():
+        # directory is scanned on every poll if filesystem notifications are not available
+        interval = WATCH_INTERVAL if watcher.notifications else WATCH_POLL_INTERVAL
+        while watchers.get(path) is watcher:
+            socketio.sleep(interval)
+            try:
+                delta = watcher.poll()
+            except OSError:
+                break  # directory has been removed
+            if delta is None:
+                continue
+            added, modified, removed = delta
+            message = serialize_delta(watcher.path, added, modified, removed)
+            with watch_lock:
+                subscribers = [subscriber for subscriber, watched in subscriptions.items() if watched == path]
+            for subscriber in subscribers:
+                socketio.emit("directory_delta", message, namespace="/analyzer", room=subscriber)
+            schedule_precompute(watcher.path, added + modified)
+        with watch_lock:
+            if watchers.get(path) is watcher:
+                del watchers[path]
+        watcher.stop()
+
+    socketio.start_background_task(watch)
+
+
+def unwatch_directory(sid):
+    """Cancels subscription of the client. Watcher of the directory is stopped when its last subscriber leaves."""
+    with watch_lock:
+        path = subscriptions.pop(sid, None)
+        if path is None or path in subscriptions.values():
+            return
+        watcher = watchers.pop(path, None)
+    if watcher is not None:
+        watcher.stop()
+
+
 @socketio.on("connect", namespace="/analyzer")
 def connect():
     """This function is called whenever new socketio connection with the server from client is initiated to the
@@ -309,7 +754,18 @@ def connect():
             path = "."
         else:
             path = urllib.parse.unquote(path)
-    emit("directory_info", serialize_path(path), namespace="/analyzer")
+    serialized = serialize_path(path)
+    emit("directory_info", serialized, namespace="/analyzer")
+    if not serialized["invalid"]:
+        watch_directory(request.sid, serialized["path"])
+
+
+@socketio.on("disconnect", namespace="/analyzer")
+def analyzer_disconnect():
+    """This function is called whenever the socketio connection with the server is terminated by the client
+    to the /analyzer namespace. Directory watcher and running analysis of the client are stopped."""
+    unwatch_directory(request.sid)
+    analyses.pop(request.sid, None)
 
 
 @socketio.on("change_path", namespace="/analyzer")
@@ -319,31 +775,84 @@ def change_path(path):
     serialized = serialize_path(path)
     if not serialized["invalid"]:
         session["directory"] = path
+        watch_directory(request.sid, serialized["path"])
     emit("directory_info", serialized, namespace="/analyzer")
 
 
+def run_analysis(sid, token, file_path, options):
+    """
+    Background task analyzing the spectrum selected by the client. Results are sent in stages
+    as soon as they are available - decimated spectrum preview (spectrum_preview), parameters
+    of the transformation (scales_computed), the transformation image (cwt_plotted) and finally
+    the reduced spectrum (file_analyzed). Analysis is abandoned between stages when the client
+    selects another spectrum or disconnects.
+    :param sid: Client's socketio connection identifier.
+    :param token: Token of this analysis, see analyses dictionary.
+    :param file_path: Path to the spectrum file.
+    :param options: Transformation options, see analysis_options function.
+    """
+
+    def current():
+        socketio.sleep()  # let other clients be served between stages
+        return analyses.get(sid) is token
+
+    def send(event, message):
+        message["path"] = file_path
+        socketio.emit(event, message, namespace="/analyzer", room=sid)
+
+    try:
+        data = Spectrum.read_data(file_path)
+    except ValueError:
+        data = None  # file has been removed in the meantime
+    if data is None:
+        send("file_analyzed", {"invalid": True})
+        return
+    wavelength, values = data
+    send("spectrum_preview", {"file_name": os.path.basename(file_path),
+                              "spectrum_img": Spectrum.plot_preview(values, wavelength)})
+    if not current():
+        return
+    spectrum = load_spectrum(file_path, **options)
+    if spectrum is None:
+        send("file_analyzed", {"invalid": True})
+        return
+    send("scales_computed", {"freq0": spectrum.freq0, "wSize": spectrum.wSize, "scales": len(spectrum.scales),
+                             "computed": spectrum.computed_range})
+    if not current():
+        return
+    send("cwt_plotted", {"cwt_img": spectrum.plot_cwt()})
+    if not current():
+        return
+    send("file_analyzed", {"invalid": False, "transformation_img": spectrum.plot_reduced_spectrum()})
+
+
 @socketio.on("analyze_file", namespace="/analyzer")
-def analyze_file(file_path):
-    """This function is called by client when he selects a spectrum for analyzing."""
-    if not os.path.isfile(file_path):
-        res = {"invalid": True}
+def analyze_file(data):
+    """This function is called by client when he selects a spectrum for analyzing. The message is
+    either the spectrum path or a dictionary with path item and optional transformation options
+    dj, min_scale and max_scale limiting the initially computed scales. Spectrum is analyzed in the
+    background, see run_analysis function, and the previous analysis of the client is cancelled."""
+    token = object()
+    analyses[request.sid] = token
+    if isinstance(data, dict):
+        file_path = data["path"]
+        try:
+            options = analysis_options(data)
+        except ValueError:
+            options = None
     else:
-        spectrum = Spectrum.read_spectrum(file_path)
-        if spectrum is None:
-            res = {"invalid": True}
-        else:
-            session["spectrum"] = spectrum
-            res = {
-                "invalid": False,
-                "spectrum_img": spectrum.plot_spectrum(),
-                "freq0": spectrum.freq0,
-                "wSize": spectrum.wSize,
-                "scales": len(spectrum.scales),
-                "cwt_img": spectrum.plot_cwt(),
-                "transformation_img": spectrum.plot_reduced_spectrum(),
-                "file_name": os.path.basename(file_path)}
-
-    emit("file_analyzed", res, namespace="/analyzer")
+        file_path = data
+        options = analysis_options(dict())
+    if options is None or not os.path.isfile(file_path):
+        emit("file_analyzed", {"invalid": True, "path": file_path}, namespace="/analyzer")
+        return
+    # only the reference is saved - spectrum itself lives in the shared store,
+    # parameters are None until the client moves a slider (spectrum defaults are used)
+    session["spectrum"] = file_path
+    session["options"] = options
+    session["freq0"] = None
+    session["wSize"] = None
+    socketio.start_background_task(run_analysis, request.sid, token, file_path, options)
 
 
 @socketio.on("slider_changed", namespace="/analyzer")
@@ -351,11 +860,15 @@ def slider_changed(data):
     """This function is called whenever client moves with one of
     transformation parameter slider. It recounts transformation for
     the specified parameters and returns newly plotted image to the user."""
-    freq0 = data['freq0']
-    wSize = data['wSize']
-    spectrum = session["spectrum"]
-    spectrum.modify_parameters(freq0, wSize)
-    emit("transformation_updated", spectrum.plot_reduced_spectrum(only_transformation=data['only-transformation']),
+    spectrum = load_spectrum(session["spectrum"], **session["options"])
+    if spectrum is None:
+        # spectrum file has been removed or modified to an invalid one in the meantime
+        emit("file_analyzed", {"invalid": True}, namespace="/analyzer")
+        return
+    freq0, wSize = spectrum.adjust_parameters(data['freq0'], data['wSize'])
+    session["freq0"] = freq0
+    session["wSize"] = wSize
+    emit("transformation_updated", spectrum.plot_reduced_spectrum(data['only-transformation'], freq0, wSize),
          namespace="/analyzer")
 
 
@@ -363,16 +876,128 @@ def slider_changed(data):
 def only_trans_changed(expected):
     """This function is called whenever client clicks on the checkbox - show only transformation.
     The transformation plot must be replotted and returned to the client."""
-    spectrum = session["spectrum"]
-    emit("transformation_updated", spectrum.plot_reduced_spectrum(only_transformation=expected), namespace="/analyzer")
+    spectrum = load_spectrum(session["spectrum"], **session["options"])
+    if spectrum is None:
+        emit("file_analyzed", {"invalid": True}, namespace="/analyzer")
+        return
+    emit("transformation_updated", spectrum.plot_reduced_spectrum(expected, session["freq0"], session["wSize"]),
+         namespace="/analyzer")
+
+
+def update_index(directory):
+    """
+    Background task incrementally updating the similarity index of the directory. Other clients
+    are served between transformations of spectra. Updates of one directory are not run concurrently
+    and at most once per INDEX_UPDATE_INTERVAL.
+    :param directory: Absolute path to the indexed directory.
+    """
+    try:
+        SpectraIndex(directory).update(progress_callback=lambda name: socketio.sleep())
+    except OSError:
+        pass  # read-only archive or the directory has been removed
+    finally:
+        with index_lock:
+            index_updating.discard(directory)
+
+
+def schedule_index_update(directory):
+    """Starts background update of the similarity index of the directory unless it is already
+    running or the index has been updated recently."""
+    now = time.monotonic()
+    with index_lock:
+        if directory in index_updating or now - index_updated.get(directory, -INDEX_UPDATE_INTERVAL) < \
+                INDEX_UPDATE_INTERVAL:
+            return
+        index_updating.add(directory)
+        index_updated[directory] = now
+    socketio.start_background_task(update_index, directory)
+
+
+def build_index(directory):
+    """
+    Builds similarity index of the directory which has not been indexed yet. The build is guarded
+    like updates (see update_index function), if another task is building or updating the index,
+    it is awaited instead.
+    :param directory: Absolute path to the indexed directory.
+    :return: SpectraIndex instance.
+    """
+    while True:
+        with index_lock:
+            running = directory in index_updating
+            if not running:
+                index_updating.add(directory)
+                index_updated[directory] = time.monotonic()
+        if not running:
+            break
+        while directory in index_updating:
+            socketio.sleep(INDEX_WAIT_INTERVAL)
+        index = SpectraIndex(directory)
+        if index.exists:
+            return index
+    try:
+        index = SpectraIndex(directory)
+        index.update(progress_callback=lambda name: socketio.sleep())
+        return index
+    finally:
+        with index_lock:
+            index_updating.discard(directory)
+
+
+def search_similar(sid, file_path, k):
+    """
+    Background task finding spectra similar to the spectrum file and sending them to the client.
+    Existing similarity index of the directory is queried and updated in the background afterwards,
+    the index is built only if the directory has not been indexed yet.
+    :param sid: Client's socketio connection identifier.
+    :param file_path: Path to the spectrum file.
+    :param k: Maximal number of found spectra.
+    """
+    res = {"path": file_path, "invalid": True}
+    try:
+        if os.path.isfile(file_path):
+            directory = os.path.dirname(os.path.abspath(file_path))
+            index = SpectraIndex(directory)
+            if not index.exists:
+                index = build_index(directory)
+            else:
+                schedule_index_update(directory)
+            results = index.query_file(file_path, k)
+            if results is not None:
+                res["invalid"] = False
+                res["spectra"] = [{"path": path, "name": os.path.basename(path), "similarity": similarity}
+                                  for path, similarity in results]
+    except OSError:
+        pass  # index cannot be written (read-only archive) or files have been removed in the meantime
+    socketio.emit("similar_spectra", res, namespace="/analyzer", room=sid)
+
+
+@socketio.on("find_similar", namespace="/analyzer")
+def find_similar(data):
+    """This function is called whenever client wants to find spectra similar to the analyzed one.
+    The search runs in the background, see search_similar function."""
+    socketio.start_background_task(search_similar, request.sid, data["path"], int(data.get("k", 10)))
+
+
+def preload():
+    """
+    Warm-up hook importing all lazily imported heavy modules (spectra downloader, astropy,
+    mlpy and matplotlib). Pre-fork servers should call it before forking the workers,
+    e.g. from the on_starting hook of gunicorn.
+    """
+    import spectra_downloader
+    preload_analyzer()
 
 
 @click.command()
 @click.option("--debug", is_flag=True, help="Setup debug flags for Flask application.")
 @click.option("--port", default=5000, help="TCP port of the web server.")
 @click.option("--host", default="127.0.0.1", help="The hostname to listen on.")
-def web(debug, port, host):
+@click.option("--preload", "preload_modules", is_flag=True,
+              help="Import heavy modules at start instead of on the first request.")
+def web(debug, port, host, preload_modules):
     """Setup click command for starting the spectra-analyzer from console."""
+    if preload_modules:
+        preload()
     socketio.run(app, debug=debug, port=port, host=host)
 
 
@@ -0,0 +1,380 @@
+import os
+import re
+import atexit
+import ctypes
+import secrets
+import weakref
+import threading
+from collections import OrderedDict
+from multiprocessing import shared_memory
+import numpy
+from .analyzer import Spectrum
+
+SEGMENT_PREFIX = "spectra_"  # names of segments are SEGMENT_PREFIX + owner pid + "_" + random suffix
+SEGMENT_DIRECTORY = "/dev/shm"  # where POSIX shared memory segments are visible on Linux
+ALIGNMENT = 64  # byte alignment of arrays inside segments
+DEFAULT_MAX_BYTES = 1 << 30  # total size of shared spectra kept by one SharedBuffers manager
+SPECTRUM_ARRAYS = ("spectrum", "wavelength", "scales", "_transformation", "_computed")
+SPECTRUM_STATE = ("freq0", "wSize")
+
+_owned = dict()  # segments created by this process, name -> SharedMemory
+_attached = dict()  # segments of other processes attached by this process, name -> SharedMemory
+_mapped = dict()  # SharedMemory -> number of live mappings of arrays returned by SharedArrays.attach
+_closing = set()  # closed SharedMemory instances which stay mapped until their arrays are garbage collected
+_lock = threading.Lock()
+
+
+def _owner(name):
+    """Returns pid of the process which created the segment."""
+    return int(name[len(SEGMENT_PREFIX):].split("_")[0])
+
+
+def _attach(name):
+    """Attaches existing segment. Segment must not stay registered in the resource tracker of
+    an unrelated process, otherwise it would be unlinked when that process exits. Children
+    of the owner share its resource tracker so their registrations are harmless."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass  # track parameter is supported since Python 3.13
+    segment = shared_memory.SharedMemory(name=name)
+    if os.name == "posix" and os.getppid() != _owner(name):
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def _close(segment):
+    """Closes segment. If arrays attached from the segment are still alive, the segment is closed
+    together with the last of them."""
+    with _lock:
+        if _mapped.get(segment):
+            _closing.add(segment)
+            return
+    segment.close()
+
+
+def _map(segment):
+    """
+    Returns ctypes array over the memory of the segment. Attached numpy arrays are created from
+    the mapping, so they keep it alive, and the segment itself is kept alive by a finalizer
+    of the mapping until the arrays are garbage collected. The mapping holds no exported buffer
+    of the segment, so the segment can be closed then.
+    :param segment: Attached SharedMemory instance.
+    :return: ctypes array of segment.size bytes.
+    """
+    anchor = ctypes.c_char.from_buffer(segment.buf)
+    mapping = (ctypes.c_char * segment.size).from_address(ctypes.addressof(anchor))
+    del anchor  # exported buffers would prevent closing of the segment
+    with _lock:
+        _mapped[segment] = _mapped.get(segment, 0) + 1
+    weakref.finalize(mapping, _unmap, segment)
+    return mapping
+
+
+def _unmap(segment):
+    """Finalizer of the mapping, closes the segment if it has been closed while its arrays were alive."""
+    with _lock:
+        count = _mapped.pop(segment) - 1
+        if count > 0:
+            _mapped[segment] = count
+            return
+        if segment not in _closing:
+            return
+        _closing.discard(segment)
+    segment.close()
+
+
+def _unlink(segment):
+    """Closes and removes segment created by this process. Removal is postponed by the system
+    until all processes detach the segment."""
+    _close(segment)
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedArrays:
+    """
+    Picklable handle of numpy arrays stored in one named shared memory segment. Handles are cheap
+    to pickle (they contain only the segment name and array layouts), processes receiving a handle
+    attach the segment and map the arrays without copying them.
+    """
+
+    def __init__(self, name, size, layout):
+        """
+        Creates handle of an existing segment, see create method.
+        :param name: Name of the shared memory segment.
+        :param size: Size of the segment in bytes.
+        :param layout: List of (array name, byte offset, shape, dtype string) tuples.
+        """
+        self.name = name
+        self.size = size
+        self.layout = layout
+
+    @classmethod
+    def create(cls, arrays):
+        """
+        Copies arrays into a new shared memory segment owned by the current process. The segment
+        exists until it is unlinked by the release function or the owner process exits (also when
+        it crashes - segments are unlinked by the resource tracker of multiprocessing then).
+        :param arrays: Dictionary mapping names to numpy arrays.
+        :return: SharedArrays handle of the segment.
+        """
+        layout = list()
+        size = 0
+        for name, array in arrays.items():
+            array = numpy.asarray(array)
+            layout.append((name, size, array.shape, array.dtype.str))
+            size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        name = "{}{}_{}".format(SEGMENT_PREFIX, os.getpid(), secrets.token_hex(6))
+        segment = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+        handle = cls(name, size, layout)
+        for (_, offset, shape, dtype), array in zip(layout, arrays.values()):
+            target = numpy.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=offset)
+            target[...] = array
+            del target  # exported buffers would prevent closing of the segment
+        with _lock:
+            _owned[name] = segment
+        return handle
+
+    def attach(self):
+        """
+        Maps arrays of the segment into the current process without copying them. Segment
+        is attached once per process, mapped arrays are read-only.
+        :return: Dictionary mapping names to numpy arrays.
+        """
+        with _lock:
+            segment = _owned.get(self.name) or _attached.get(self.name)
+            if segment is None:
+                segment = _attached[self.name] = _attach(self.name)
+        mapping = _map(segment)
+        arrays = dict()
+        for name, offset, shape, dtype in self.layout:
+            count = int(numpy.prod(shape, dtype=numpy.int64))
+            array = numpy.frombuffer(mapping, dtype=dtype, count=count, offset=offset).reshape(shape)
+            array.flags.writeable = False
+            arrays[name] = array
+        return arrays
+
+    def detach(self):
+        """Detaches the segment from the current process. Mapping is released when arrays returned by
+        the attach method are garbage collected. Segments are detached automatically when the process exits."""
+        with _lock:
+            segment = _attached.pop(self.name, None)
+        if segment is not None:
+            _close(segment)
+
+
+class SharedSpectrum(SharedArrays):
+    """Picklable handle of a transformed spectrum stored in shared memory. Attached spectrum
+    is a Spectrum instance sharing arrays of the spectrum and its transformation."""
+
+    def __init__(self, name, size, layout, state):
+        super().__init__(name, size, layout)
+        self.state = state
+
+    @classmethod
+    def create(cls, spectrum):
+        """
+        Copies arrays of the spectrum into a new shared memory segment, see SharedArrays.create.
+        :param spectrum: Spectrum instance.
+        :return: SharedSpectrum handle.
+        """
+        arrays = {name: getattr(spectrum, name) for name in SPECTRUM_ARRAYS if getattr(spectrum, name) is not None}
+        shared = SharedArrays.create(arrays)
+        return cls(shared.name, shared.size, shared.layout, {name: getattr(spectrum, name) for name in SPECTRUM_STATE})
+
+    def attach(self):
+        """
+        Returns Spectrum instance backed by the shared segment. Nothing is recomputed.
+        :return: Spectrum instance.
+        """
+        arrays = super().attach()
+        spectrum = Spectrum.__new__(Spectrum)
+        for name in SPECTRUM_ARRAYS:
+            setattr(spectrum, name, arrays.get(name))
+        for name, value in self.state.items():
+            setattr(spectrum, name, value)
+        spectrum._rec = None
+        return spectrum
+
+
+def release(handle):
+    """
+    Unlinks segment created by the current process. Processes which have already attached
+    the segment can use it until they detach it.
+    :param handle: SharedArrays handle.
+    """
+    _release(handle.name)
+
+
+def _release(name):
+    """Unlinks segment with the name if it was created by the current process. Forked children
+    inherit the dictionary of owned segments, but they must not unlink them."""
+    if _owner(name) != os.getpid():
+        return
+    with _lock:
+        segment = _owned.pop(name, None)
+    if segment is not None:
+        _unlink(segment)
+
+
+@atexit.register
+def _release_all():
+    """Unlinks all segments created by the current process when it exits normally."""
+    for name in list(_owned):
+        _release(name)
+
+
+def cleanup_orphans():
+    """
+    Removes segments left behind by owner processes which no longer exist (e.g. when the owner
+    and its resource tracker were killed together). Only supported on Linux, where segments are
+    listed in SEGMENT_DIRECTORY.
+    :return: Number of removed segments.
+    """
+    if not os.path.isdir(SEGMENT_DIRECTORY):
+        return 0
+    removed = 0
+    pattern = re.compile(r"^{}(\d+)_[0-9a-f]+$".format(re.escape(SEGMENT_PREFIX)))
+    for name in os.listdir(SEGMENT_DIRECTORY):
+        match = pattern.match(name)
+        if match is None or _alive(int(match.group(1))):
+            continue
+        try:
+            os.unlink(os.path.join(SEGMENT_DIRECTORY, name))
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def _alive(pid):
+    """Returns True if process with the pid exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedBuffers:
+    """
+    Manager of spectra shared with worker processes. Spectra are stored under keys (see
+    store.file_key) in shared memory segments and handed to workers as picklable handles,
+    so large transformation matrices are never pickled. Handles are leased - every handle
+    returned by share or get must be released by the release method (typically when
+    the worker result arrives, regardless whether the worker succeeded). Least recently used
+    spectra are evicted when the total size exceeds the limit, their segments are unlinked
+    when the last lease is released.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> handle
+        self._leases = dict()  # segment name -> number of unreleased handles
+        self._evicted = set()  # names of evicted segments which are still leased
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lease(self, handle):
+        """Increments lease count of the handle. Must be called with the lock acquired."""
+        self._leases[handle.name] = self._leases.get(handle.name, 0) + 1
+        return handle
+
+    def get(self, key):
+        """
+        Returns leased handle of a shared spectrum.
+        :param key: String key of the spectrum.
+        :return: SharedSpectrum handle or None if the spectrum is not shared.
+        """
+        with self._lock:
+            handle = self._entries.get(key)
+            if handle is None:
+                return None
+            self._entries.move_to_end(key)
+            return self._lease(handle)
+
+    def share(self, key, spectrum):
+        """
+        Shares spectrum under the key (unless it is shared already) and returns leased handle.
+        :param key: String key of the spectrum.
+        :param spectrum: Spectrum instance.
+        :return: SharedSpectrum handle.
+        """
+        handle = self.get(key)
+        if handle is not None:
+            return handle
+        created = SharedSpectrum.create(spectrum)
+        evicted = list()
+        with self._lock:
+            handle = self._entries.get(key)
+            if handle is None:
+                handle = self._entries[key] = created
+                self._size += handle.size
+                while self._size > self.max_bytes and len(self._entries) > 1:
+                    _, old = self._entries.popitem(last=False)
+                    self._size -= old.size
+                    evicted.append(old)
+            else:
+                self._entries.move_to_end(key)  # another thread has shared the spectrum meanwhile
+            self._lease(handle)
+        if handle is not created:
+            _release(created.name)
+        for old in evicted:
+            self._drop(old)
+        return handle
+
+    def release(self, handle):
+        """
+        Releases leased handle. Segment of an evicted spectrum is unlinked when its last lease is released.
+        :param handle: Handle returned by share or get method.
+        """
+        with self._lock:
+            count = self._leases.get(handle.name, 0) - 1
+            if count > 0:
+                self._leases[handle.name] = count
+                return
+            self._leases.pop(handle.name, None)
+            if handle.name not in self._evicted:
+                return
+            self._evicted.discard(handle.name)
+        _release(handle.name)
+
+    def evict(self, key):
+        """
+        Stops sharing of the spectrum. Segment is unlinked as soon as it is not leased.
+        :param key: String key of the spectrum.
+        """
+        with self._lock:
+            handle = self._entries.pop(key, None)
+            if handle is None:
+                return
+            self._size -= handle.size
+        self._drop(handle)
+
+    def _drop(self, handle):
+        """Unlinks segment of evicted handle or postpones it until the handle is released."""
+        with self._lock:
+            if self._leases.get(handle.name):
+                self._evicted.add(handle.name)
+                return
+        _release(handle.name)
+
+    def close(self):
+        """Unlinks all segments regardless of leases."""
+        with self._lock:
+            names = [handle.name for handle in self._entries.values()] + list(self._evicted)
+            self._entries.clear()
+            self._evicted.clear()
+            self._leases.clear()
+            self._size = 0
+        for name in names:
+            _release(name)
@@ -0,0 +1,280 @@
+import os
+import json
+import click
+import numpy
+from .analyzer import Spectrum, EXTENSION_MAPPING
+
+INDEX_DIRECTORY = ".spectra_index"
+FEATURE_SIZE = 96  # number of CWT scales covered by feature vectors (spectra with up to ~10^7 samples)
+
+
+def feature_vector(spectrum):
+    """
+    Returns compact feature vector of a transformed spectrum. The vector describes distribution
+    of the transformation energy over scales. Scales are the same for all spectra (they differ
+    only in count, which grows with spectrum length), missing scales are filled with zeros.
+    Vectors have unit length so the dot product of two vectors is their similarity in range [0, 1].
+    :param spectrum: Spectrum instance.
+    :return: 1D float32 numpy array of FEATURE_SIZE values.
+    """
+    transformation = spectrum._transformation[:FEATURE_SIZE]
+    energy = numpy.mean(numpy.abs(transformation) ** 2, axis=1)
+    vector = numpy.zeros(FEATURE_SIZE, dtype=numpy.float32)
+    total = energy.sum()
+    if total > 0:
+        vector[:energy.shape[0]] = numpy.sqrt(energy / total)
+    return vector
+
+
+def spectrum_files(directory):
+    """
+    Generator of spectra files in the directory and its subdirectories. Only files with extensions
+    supported by the readers are returned, the index directory is skipped.
+    :param directory: Root directory.
+    :return: Generator of paths relative to the root directory.
+    """
+    for root, dirs, files in os.walk(directory):
+        if INDEX_DIRECTORY in dirs:
+            dirs.remove(INDEX_DIRECTORY)
+        for name in files:
+            if name.split(".")[-1] in EXTENSION_MAPPING:
+                yield os.path.relpath(os.path.join(root, name), directory)
+
+
+class SpectraIndex:
+    """
+    Similarity index over feature vectors of spectra in one directory tree. Index is stored
+    on disk in the INDEX_DIRECTORY subdirectory as a numpy array of feature vectors,
+    a JSON list of indexed files and a JSON mapping of rejected files (files which are not
+    valid spectra, so they are not read again until they are modified). Queries are answered
+    by a vectorized brute-force search.
+    """
+
+    def __init__(self, directory):
+        """
+        Opens index of the directory. Empty index is created if the directory has not been indexed yet.
+        :param directory: Root directory of indexed spectra.
+        """
+        self.directory = os.path.abspath(directory)
+        self.path = os.path.join(self.directory, INDEX_DIRECTORY)
+        features_path = os.path.join(self.path, "features.npy")
+        entries_path = os.path.join(self.path, "entries.json")
+        rejected_path = os.path.join(self.path, "rejected.json")
+        self.exists = os.path.isfile(features_path) and os.path.isfile(entries_path)
+        if self.exists:
+            with open(entries_path) as f:
+                self.entries = json.load(f)
+            self.features = numpy.load(features_path, mmap_mode="r")
+        else:
+            self.entries = list()
+            self.features = numpy.zeros((0, FEATURE_SIZE), dtype=numpy.float32)
+        self.rejected = dict()  # relative path -> [mtime, size] of files which are not valid spectra
+        if self.exists and os.path.isfile(rejected_path):
+            with open(rejected_path) as f:
+                self.rejected = json.load(f)
+        self._positions = {entry["path"]: i for i, entry in enumerate(self.entries)}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def save(self):
+        """Writes the index to the disk. Files are replaced atomically so concurrent readers
+        never see partially written index."""
+        os.makedirs(self.path, exist_ok=True)
+        features_path = os.path.join(self.path, "features.npy")
+        entries_path = os.path.join(self.path, "entries.json")
+        rejected_path = os.path.join(self.path, "rejected.json")
+        suffix = ".{}.tmp".format(os.getpid())  # processes sharing the directory do not overwrite their files
+        with open(features_path + suffix, "wb") as f:
+            numpy.save(f, numpy.ascontiguousarray(self.features, dtype=numpy.float32))
+        with open(entries_path + suffix, "w") as f:
+            json.dump(self.entries, f)
+        with open(rejected_path + suffix, "w") as f:
+            json.dump(self.rejected, f)
+        os.replace(rejected_path + suffix, rejected_path)
+        os.replace(features_path + suffix, features_path)
+        os.replace(entries_path + suffix, entries_path)
+        self.exists = True
+
+    def _stat(self, name):
+        """Returns modification time and size of the indexed file."""
+        stat = os.stat(os.path.join(self.directory, name))
+        return stat.st_mtime_ns, stat.st_size
+
+    def _is_rejected(self, name):
+        """Returns True if the file has been rejected as an invalid spectrum and it has not been modified since."""
+        rejected = self.rejected.get(name)
+        try:
+            return rejected is not None and tuple(rejected) == self._stat(name)
+        except OSError:
+            return False
+
+    def _rebuild(self, keep, added):
+        """Replaces index content by kept rows and added (entry, vector) pairs."""
+        keep = numpy.asarray(keep, dtype=bool)
+        entries = [entry for entry, kept in zip(self.entries, keep) if kept]
+        vectors = [numpy.asarray(self.features)[keep]] if len(self.entries) else list()
+        if added:
+            entries.extend(entry for entry, _ in added)
+            vectors.append(numpy.vstack([vector for _, vector in added]))
+        self.entries = entries
+        self.features = numpy.vstack(vectors) if vectors else numpy.zeros((0, FEATURE_SIZE), dtype=numpy.float32)
+        self._positions = {entry["path"]: i for i, entry in enumerate(self.entries)}
+
+    def _entry(self, name):
+        """Reads and transforms spectrum file. Returns pair (entry, feature vector) or None for invalid spectra,
+        which are recorded as rejected."""
+        mtime, size = self._stat(name)
+        spectrum = Spectrum.read_spectrum(os.path.join(self.directory, name), cached=False)
+        if spectrum is None:
+            self.rejected[name] = [mtime, size]
+            return None
+        self.rejected.pop(name, None)
+        return {"path": name, "mtime": mtime, "size": size}, feature_vector(spectrum)
+
+    def add(self, path):
+        """
+        Adds spectrum file into the index or updates its feature vector if the file was modified.
+        Changes must be written by the save method.
+        :param path: Path to the spectrum file inside the indexed directory.
+        :return: True if the file is a valid spectrum and it is indexed.
+        """
+        name = os.path.relpath(os.path.abspath(path), self.directory)
+        position = self._positions.get(name)
+        if position is not None:
+            entry = self.entries[position]
+            if (entry["mtime"], entry["size"]) == self._stat(name):
+                return True
+        added = self._entry(name)
+        keep = numpy.ones(len(self.entries), dtype=bool)
+        if position is not None:
+            keep[position] = False
+        self._rebuild(keep, [added] if added is not None else list())
+        return added is not None
+
+    def remove(self, path):
+        """
+        Removes spectrum file from the index. Changes must be written by the save method.
+        :param path: Path to the spectrum file inside the indexed directory.
+        :return: True if the file was indexed.
+        """
+        name = os.path.relpath(os.path.abspath(path), self.directory)
+        self.rejected.pop(name, None)
+        position = self._positions.get(name)
+        if position is None:
+            return False
+        keep = numpy.ones(len(self.entries), dtype=bool)
+        keep[position] = False
+        self._rebuild(keep, list())
+        return True
+
+    def update(self, progress_callback=None):
+        """
+        Synchronizes the index with the directory content and saves it. Only new and modified
+        files are transformed, removed files are dropped from the index. Rejected files are
+        read again only if they have been modified.
+        :param progress_callback: Optional function called with the relative path of every transformed file.
+        :return: Tuple (number of added or updated files, number of removed files).
+        """
+        current = set(spectrum_files(self.directory))
+        keep = numpy.zeros(len(self.entries), dtype=bool)
+        for i, entry in enumerate(self.entries):
+            name = entry["path"]
+            if name in current:
+                try:
+                    keep[i] = (entry["mtime"], entry["size"]) == self._stat(name)
+                except OSError:
+                    pass
+        added = list()
+        indexed = {entry["path"] for entry, kept in zip(self.entries, keep) if kept}
+        rejected = dict(self.rejected)
+        self.rejected = {name: value for name, value in rejected.items() if name in current}
+        for name in sorted(current - indexed):
+            if self._is_rejected(name):
+                continue
+            if progress_callback is not None:
+                progress_callback(name)
+            try:
+                result = self._entry(name)
+            except OSError:
+                continue  # file has been removed in the meantime
+            if result is not None:
+                added.append(result)
+        removed = sum(1 for entry in self.entries if entry["path"] not in current)
+        if added or not keep.all() or self.rejected != rejected or not self.exists:
+            self._rebuild(keep, added)
+            self.save()
+        return len(added), removed
+
+    def query(self, vector, k=10, exclude=None):
+        """
+        Finds k spectra with the most similar feature vectors.
+        :param vector: Feature vector, see feature_vector function.
+        :param k: Maximal number of returned spectra.
+        :param exclude: Relative path of a file which should not be returned (typically the query file).
+        :return: List of (path, similarity) pairs sorted by decreasing similarity.
+        """
+        if len(self.entries) == 0 or k <= 0:
+            return list()
+        scores = numpy.asarray(self.features) @ numpy.asarray(vector, dtype=numpy.float32)
+        excluded = self._positions.get(exclude)
+        if excluded is not None:
+            scores[excluded] = -numpy.inf
+        k = min(k, scores.shape[0] - (excluded is not None))
+        if k <= 0:
+            return list()
+        best = numpy.argpartition(-scores, k - 1)[:k]
+        best = best[numpy.argsort(-scores[best], kind="mergesort")]
+        return [(os.path.join(self.directory, self.entries[i]["path"]), float(scores[i])) for i in best]
+
+    def query_file(self, path, k=10):
+        """
+        Finds k spectra most similar to the passed spectrum file. Feature vector stored in the index
+        is used if the file is indexed and not modified.
+        :param path: Path to the spectrum file.
+        :param k: Maximal number of returned spectra.
+        :return: List of (path, similarity) pairs sorted by decreasing similarity. None if the file
+        is not a valid spectrum.
+        """
+        path = os.path.abspath(path)
+        name = os.path.relpath(path, self.directory)
+        position = self._positions.get(name)
+        if position is not None and (self.entries[position]["mtime"], self.entries[position]["size"]) == \
+                self._stat(name):
+            vector = self.features[position]
+        else:
+            spectrum = Spectrum.read_spectrum(path)
+            if spectrum is None:
+                return None
+            vector = feature_vector(spectrum)
+        return self.query(vector, k, exclude=name)
+
+
+@click.group()
+def cli():
+    """Similarity index of spectra archives."""
+    pass
+
+
+@cli.command()
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+def update(directory):
+    """Create or incrementally update the index of DIRECTORY."""
+    index = SpectraIndex(directory)
+    added, removed = index.update(progress_callback=lambda name: click.echo("indexing {}".format(name)))
+    click.echo("{} spectra indexed ({} added or updated, {} removed)".format(len(index), added, removed))
+
+
+@cli.command()
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option("-k", default=10, help="Number of returned spectra.")
+@click.option("--directory", type=click.Path(exists=True, file_okay=False),
+              help="Indexed directory, the directory of FILE implicitly.")
+def query(file, k, directory):
+    """Find spectra similar to FILE."""
+    index = SpectraIndex(directory or os.path.dirname(os.path.abspath(file)))
+    results = index.query_file(file, k)
+    if results is None:
+        raise click.ClickException("{} is not a valid spectrum".format(file))
+    for path, similarity in results:
+        click.echo("{:.6f}  {}".format(similarity, path))
@@ -7,6 +7,7 @@ $(document).ready(function () {
     });
     var loadedDirectoryPath = "";
     var loadedDirectory;
+    var analyzedPath;
     var scales;
     //on follow path button click event
     $('#follow-path').click(function () {
@@ -105,14 +106,7 @@ $(document).ready(function () {
         });
     }
 
-    function refreshPath(data) {
-        if (data['invalid']) {
-            alert('The path ' + data['path'] + ' is invalid');
-            $('#spectrum-path').val(loadedDirectoryPath);
-            return;
-        }
-        loadedDirectoryPath = data['path'];
-        loadedDirectory = data['directory'];
+    function renderDirectory() {
         var $tbody = $('#directory-listing');
         $tbody.html('');
         var item;
@@ -121,8 +115,6 @@ $(document).ready(function () {
             var $tr = $('<tr>', {'id': 'row' + i});
             if (item['selected']) {
                 $tr.addClass('selected-row');
-                showProgress();
-                socket.emit('analyze_file', item['path']);
             }
             if (item['is_file']) {
                 $tr.addClass('file');
@@ -142,34 +134,141 @@ $(document).ready(function () {
             }
             $tbody.append($tr);
         }
+        registerRowClickEvents();
+    }
+
+    function refreshPath(data) {
+        if (data['invalid']) {
+            alert('The path ' + data['path'] + ' is invalid');
+            $('#spectrum-path').val(loadedDirectoryPath);
+            return;
+        }
+        loadedDirectoryPath = data['path'];
+        loadedDirectory = data['directory'];
+        renderDirectory();
+        for (var i = 0; i < loadedDirectory.length; i++) {
+            if (loadedDirectory[i]['selected']) {
+                showProgress();
+                analyzedPath = loadedDirectory[i]['path'];
+                socket.emit('analyze_file', analyzedPath);
+            }
+        }
         $('#spectrum-path').val(loadedDirectoryPath);
         $.cookie('last-directory', loadedDirectoryPath);
-        registerRowClickEvents();
+    }
+
+    function applyDelta(delta) {
+        if (delta['path'] != loadedDirectoryPath) {
+            return;
+        }
+        var changed = {};
+        var i;
+        for (i = 0; i < delta['removed'].length; i++) {
+            changed[delta['removed'][i]] = null;
+        }
+        for (i = 0; i < delta['modified'].length; i++) {
+            changed[delta['modified'][i]['path']] = delta['modified'][i];
+        }
+        var directory = [];
+        for (i = 0; i < loadedDirectory.length; i++) {
+            var item = loadedDirectory[i];
+            if (!(item['path'] in changed) || item['name'] == '..') {
+                directory.push(item);
+            } else if (changed[item['path']] !== null) {
+                changed[item['path']]['selected'] = item['selected'];
+                directory.push(changed[item['path']]);
+            }
+        }
+        loadedDirectory = directory.concat(delta['added']);
+        renderDirectory();
     }
 
     socket.on("directory_info", function (response) {
         refreshPath(response);
     });
 
+    socket.on("directory_delta", function (response) {
+        applyDelta(response);
+    });
+
+    function isStale(response) {
+        //messages of cancelled analyses may still arrive after another spectrum was selected
+        return 'path' in response && response['path'] != analyzedPath;
+    }
+
+    function imageSource(image) {
+        return image ? 'data:image/png;base64,' + image : '';
+    }
+
+    socket.on("spectrum_preview", function (response) {
+        if (isStale(response)) {
+            return;
+        }
+        $('.similar').addClass('hidden');
+        $('.file-invalid').addClass('hidden');
+        var $view = $('.file-analyze').removeClass('hidden');
+        $('.spectrum-name').html(response['file_name']);
+        $('#spectrum-plot').prop('src', imageSource(response['spectrum_img']));
+        $('#cwt-plot').prop('src', '');
+        $('#transformation-plot').prop('src', '');
+        $view[0].scrollIntoView({behavior: 'smooth'});
+    });
+
+    socket.on("scales_computed", function (response) {
+        if (isStale(response)) {
+            return;
+        }
+        $('#freq0').val(response['freq0']).find('~ span').html(response['freq0']);
+        $('#wSize').val(response['wSize']).find('~ span').html(response['wSize']);
+        scales = response['scales'];
+    });
+
+    socket.on("cwt_plotted", function (response) {
+        if (isStale(response)) {
+            return;
+        }
+        $('#cwt-plot').prop('src', imageSource(response['cwt_img']));
+    });
+
     socket.on("file_analyzed", function (response) {
+        if (isStale(response)) {
+            return;
+        }
         hideProgress();
         if (response['invalid']) {
+            $('.similar').addClass('hidden');
             $('.file-analyze').addClass('hidden');
             var $invalid = $('.file-invalid');
             $invalid.removeClass('hidden');
             $invalid[0].scrollIntoView();
         } else {
-            $('.file-invalid').addClass('hidden');
-            var $view = $('.file-analyze').removeClass('hidden');
-            $('.spectrum-name').html(response['file_name']);
-            $('#spectrum-plot').prop('src', 'data:image/png;base64,' + response['spectrum_img']);
-            $('#freq0').val(response['freq0']).find('~ span').html(response['freq0']);
-            $('#wSize').val(response['wSize']).find('~ span').html(response['wSize']);
-            scales = response['scales'];
-            $('#cwt-plot').prop('src', 'data:image/png;base64,' + response['cwt_img']);
-            $('#transformation-plot').prop('src', 'data:image/png;base64,' + response['transformation_img']);
-            $view[0].scrollIntoView({behavior: 'smooth'});
+            $('#transformation-plot').prop('src', imageSource(response['transformation_img']));
+        }
+    });
+
+    $('#find-similar').click(function () {
+        $('.progress-similar').removeClass('hidden');
+        socket.emit('find_similar', {'path': analyzedPath, 'k': 10});
+    });
+
+    socket.on("similar_spectra", function (response) {
+        $('.progress-similar').addClass('hidden');
+        if (response['invalid'] || response['path'] != analyzedPath) {
+            return;
+        }
+        var $tbody = $('#similar-listing');
+        $tbody.html('');
+        var spectra = response['spectra'];
+        for (var i = 0; i < spectra.length; i++) {
+            var $tr = $('<tr>').addClass('file').data('path', spectra[i]['path']);
+            $tr.append($('<td>').addClass('name').html(spectra[i]['name']));
+            $tr.append($('<td>').html(spectra[i]['similarity'].toFixed(4)));
+            $tr.click(function () {
+                socket.emit('change_path', $(this).data('path'));
+            });
+            $tbody.append($tr);
         }
+        $('.similar').removeClass('hidden');
     });
 
     socket.on("transformation_updated", function (response) {
@@ -165,6 +165,7 @@ $(document).ready(function () {
         //prepare lines in a table
         downloadIndex = 0;
         $('#download-log-body').html('');
+        $('.download-counter').html('0');
         //emit message
         socket.emit('download_spectra', message);
 //                window.history.pushState(null, "Downloading", "/downloading")
@@ -283,21 +284,36 @@ $(document).ready(function () {
         votableSet(true);
     });
 
-    socket.on("spectrum_downloaded", function (response) {
+    function formatRate(response) {
+        var size = response['bytes_per_second'];
+        var units = ['B', 'kB', 'MB', 'GB'];
+        var unit = 0;
+        while (size >= 1000 && unit < units.length - 1) {
+            size /= 1000;
+            unit++;
+        }
+        return response['files_per_second'].toFixed(1) + ' spectra/s, ' + size.toFixed(2) + ' ' + units[unit] + '/s';
+    }
+
+    socket.on("download_progress", function (response) {
+        $('#download-count').html(response['downloaded'] + response['failed'] + response['skipped']);
+        $('#download-total').html(response['total']);
+        $('#download-failed').html(response['failed']);
+        $('#download-skipped').html(response['skipped']);
+        $('#download-duplicates').html(response['duplicates']);
+        $('#download-size').html(response['size']);
+        $('#download-rate').html(formatRate(response));
+        //only failed downloads are listed in the log
         var $logBody = $('#download-log-body');
-        var $name = $('<td>').html(response['file_name']);
-        var $downloadLink = $('<td>').append($('<a>', {'href': response['url']}).html('link'));
-        var $state;
-        var $problem;
-        if (response.success) {
-            $state = $('<td>').addClass('success').html("SUCCESS");
-            $problem = $('<td>');
-        } else {
-            $state = $('<td>').addClass('fail').html("FAILED");
-            $problem = $('<td>').html(response['exception']);
+        var failures = response['failures'];
+        for (var i = 0; i < failures.length; i++) {
+            var failure = failures[i];
+            var $name = $('<td>').html(failure['file_name']);
+            var $downloadLink = $('<td>').append($('<a>', {'href': failure['url']}).html('link'));
+            var $state = $('<td>').addClass('fail').html("FAILED");
+            var $problem = $('<td>').html(failure['exception']);
+            $logBody.append($('<tr>').append($name).append($downloadLink).append($state).append($problem));
         }
-        console.log('appending');
-        $logBody.append($('<tr>').append($name).append($downloadLink).append($state).append($problem));
     });
 
     socket.on("spectra_downloaded", function (success) {
@@ -0,0 +1,150 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from .dedup import content_hash
+
+
+def file_key(file_path):
+    """
+    Returns store key identifying the current content of a file. The key consists of the content
+    hash and the file extension (which selects the reader), so duplicate files under different
+    names share one analysis and modified files get a new key.
+    :param file_path: Filesystem path to an existing file.
+    :return: String key.
+    """
+    return "{}.{}".format(content_hash(file_path), file_path.split(".")[-1])
+
+
+class SpectrumStore:
+    """Abstract class for stores of analyzed spectra. Stored values are never modified
+    so they can be shared by all clients (and processes in case of shared stores)."""
+
+    max_entries = 0  # capacity of the store, least recently used values above it are evicted
+
+    def get(self, key):
+        """
+        This method must be overrided in subclasses. It returns the value stored under the passed key.
+        :param key: String key, see file_key function.
+        :return: Stored value or None if there is no such value.
+        """
+        pass
+
+    def put(self, key, value):
+        """
+        This method must be overrided in subclasses. It stores the value under the passed key.
+        Least recently used values may be evicted.
+        :param key: String key, see file_key function.
+        :param value: Picklable value.
+        """
+        pass
+
+    def discard(self, key):
+        """
+        This method must be overrided in subclasses. It removes the value stored under the passed key if any.
+        :param key: String key, see file_key function.
+        """
+        pass
+
+
+class MemoryStore(SpectrumStore):
+    """Specific spectrum store. Keeps values in the memory of the current process
+    and evicts least recently used values."""
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._values.get(key)
+            if value is not None:
+                self._values.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class SqliteStore(SpectrumStore):
+    """Specific spectrum store. Keeps pickled values in a SQLite database file shared by all
+    worker processes on the host. Recently used values are also kept in a small in-process
+    memory store, which is safe because the values are never modified."""
+
+    def __init__(self, path, max_entries=64, local_entries=4):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = MemoryStore(local_entries)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        with self._lock:
+            self._connect().execute("CREATE TABLE IF NOT EXISTS spectra "
+                                    "(key TEXT PRIMARY KEY, value BLOB NOT NULL, accessed REAL NOT NULL)")
+
+    def _connect(self):
+        """Returns connection to the database. Connections are not shared with forked processes.
+        Must be called with the lock acquired."""
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                               check_same_thread=False)
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        value = self._local.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT value FROM spectra WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE spectra SET accessed = ? WHERE key = ?", (time.time(), key))
+        value = pickle.loads(row[0])
+        self._local.put(key, value)
+        return value
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._local.put(key, value)
+        with self._lock:
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO spectra (key, value, accessed) VALUES (?, ?, ?)",
+                               (key, sqlite3.Binary(data), time.time()))
+            connection.execute("DELETE FROM spectra WHERE key NOT IN "
+                               "(SELECT key FROM spectra ORDER BY accessed DESC LIMIT ?)", (self.max_entries,))
+
+    def discard(self, key):
+        self._local.discard(key)
+        with self._lock:
+            self._connect().execute("DELETE FROM spectra WHERE key = ?", (key,))
+
+
+def create_store(url):
+    """
+    Factory function for spectrum stores. Supported URLs are memory:// for a store
+    private to the current process and sqlite:///path/to/file.db for a store shared
+    by all processes on the host.
+    :param url: Store URL.
+    :return: SpectrumStore instance.
+    """
+    if url == "memory://":
+        return MemoryStore()
+    if url.startswith("sqlite://"):
+        path = url[len("sqlite://"):]
+        if not path:
+            raise ValueError("SQLite store URL must contain a database path")
+        return SqliteStore(path)
+    raise ValueError("Unsupported spectrum store URL: {}".format(url))
@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+
+DEBOUNCE = 0.5  # quiet period in seconds required before a burst of changes is reported
+MAX_DELAY = 2.0  # maximal delay in seconds of reporting changes of a directory which keeps changing
+
+
+def _scan(path):
+    """Returns snapshot of the directory - mapping of entry names to (is_file, mtime, size)."""
+    snapshot = dict()
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                snapshot[entry.name] = _stat_entry(entry)
+            except OSError:
+                pass  # entry removed during scanning
+    return snapshot
+
+
+def _stat_entry(entry):
+    """Returns snapshot value of one directory entry (os.DirEntry or path)."""
+    stat = entry.stat() if isinstance(entry, os.DirEntry) else os.stat(entry)
+    is_dir = (entry.is_dir() if isinstance(entry, os.DirEntry) else os.path.isdir(entry))
+    return not is_dir, stat.st_mtime_ns, stat.st_size
+
+
+class DirectoryWatcher:
+    """
+    Watches content of one directory (not its subdirectories) and reports changes as deltas.
+    Filesystem notifications of the watchdog library are used if it is installed, otherwise
+    the directory is polled. Watcher is passive - the poll method must be called periodically
+    and it reports changes only after the directory has been quiet for the debounce period,
+    so bursts of changes (e.g. a file being written) are coalesced into one delta. Changes
+    of a directory which never becomes quiet are reported at the latest after the maximal delay.
+    """
+
+    def __init__(self, path, debounce=DEBOUNCE, use_watchdog=True, max_delay=MAX_DELAY):
+        """
+        Starts watching the directory.
+        :param path: Path to an existing directory.
+        :param debounce: Quiet period in seconds required before changes are reported.
+        :param max_delay: Maximal time in seconds from the first unreported change until changes are reported.
+        :param use_watchdog: Use filesystem notifications if the watchdog library is available.
+        """
+        self.path = os.path.abspath(path)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._snapshot = _scan(self.path)
+        self._pending = self._snapshot  # last polled snapshot which has not been reported yet
+        self._lock = threading.Lock()
+        self._changed = set()
+        self._last_change = None
+        self._first_change = None  # time of the first unreported change
+        self._observer = None
+        if use_watchdog:
+            self._start_observer()
+
+    def _start_observer(self):
+        """Starts watchdog observer. Polling is used if watchdog is not installed or the observer fails."""
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                paths = [event.src_path, getattr(event, "dest_path", "")]
+                names = [os.path.basename(p) for p in paths if p and os.path.dirname(p) == watcher.path]
+                if names:
+                    watcher._notify(names)
+
+        observer = Observer()
+        try:
+            observer.schedule(Handler(), self.path, recursive=False)
+            observer.daemon = True
+            observer.start()
+        except OSError:
+            return
+        self._observer = observer
+
+    @property
+    def notifications(self):
+        """True if filesystem notifications are used, False if the directory is polled."""
+        return self._observer is not None
+
+    def _notify(self, names):
+        """Records names of changed entries. Called from the observer thread."""
+        with self._lock:
+            self._changed.update(names)
+            self._last_change = time.monotonic()
+            if self._first_change is None:
+                self._first_change = self._last_change
+
+    def _current(self):
+        """Returns current snapshot built from the last reported one by examining only the notified entries."""
+        with self._lock:
+            changed = self._changed
+            self._changed = set()
+        snapshot = dict(self._snapshot)
+        for name in changed:
+            try:
+                snapshot[name] = _stat_entry(os.path.join(self.path, name))
+            except OSError:
+                snapshot.pop(name, None)
+        return snapshot
+
+    def poll(self):
+        """
+        Returns changes of the directory since the last reported delta. Changes are reported
+        only if the directory has been quiet for the debounce period or the first of them
+        is older than the maximal delay.
+        :return: Tuple (added names, modified names, removed names) or None if there is nothing to report.
+        """
+        now = time.monotonic()
+        if self._observer is None:
+            snapshot = _scan(self.path)
+            if snapshot != self._pending:
+                self._pending = snapshot
+                self._last_change = now
+                if self._first_change is None:
+                    self._first_change = now
+        with self._lock:
+            if self._last_change is None:
+                return None
+            if now - self._last_change < self.debounce and now - self._first_change < self.max_delay:
+                return None
+            self._last_change = None
+            self._first_change = None
+        current = self._pending if self._observer is None else self._current()
+        previous = self._snapshot
+        self._snapshot = current
+        added = sorted(name for name in current if name not in previous)
+        removed = sorted(name for name in previous if name not in current)
+        modified = sorted(name for name in current if name in previous and current[name] != previous[name])
+        if not (added or modified or removed):
+            return None
+        return added, modified, removed
+
+    def stop(self):
+        """Stops watching the directory."""
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
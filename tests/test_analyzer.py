@@ -1,5 +1,6 @@
 import pytest
 import os
+import numpy
 from tests import test_analyzer
 from spectra_analyzer import analyzer
 
@@ -101,3 +102,162 @@ def test_rec_invalidation(spectrum_inst):
     assert spectrum_inst._rec is not None
     spectrum_inst.modify_parameters(5, 4)
     assert spectrum_inst._rec is None
+
+
+@pytest.mark.parametrize("file", ["binary.vot", "spectrum.asc", "spectrum.csv", "spectrum.fits",
+                                  "spectrum.fit", "spectrum.txt", "tabledata.vot"])
+def test_wavelength_kept(file):
+    """Test that readers keep x spectrum values and that they form a uniform grid."""
+    res = analyzer.Spectrum.read_spectrum(file_ref(file))
+    assert res.wavelength is not None
+    assert res.wavelength.shape == res.spectrum.shape
+    steps = numpy.diff(res.wavelength)
+    assert numpy.allclose(steps, steps[0], rtol=1e-3)
+
+
+@pytest.mark.parametrize("method", analyzer.RESAMPLING_METHODS)
+def test_resample_uniform_grid(method):
+    """Test that non-uniformly sampled spectrum is resampled onto a uniform grid."""
+    wavelength = numpy.array([1.0, 2.0, 4.0, 5.0, 8.0, 9.0])
+    flux = numpy.array([1.0, 2.0, 4.0, 5.0, 8.0, 9.0])
+    grid, resampled = analyzer.resample(wavelength, flux, method=method)
+    assert grid.shape == resampled.shape == (6,)
+    assert numpy.allclose(numpy.diff(grid), 1.6)
+    assert grid[0] == 1.0 and grid[-1] == 9.0
+    if method == "linear":
+        assert numpy.allclose(resampled, grid)
+
+
+def test_resample_rebin_conserves_flux():
+    """Test that rebinning conserves total flux of the spectrum."""
+    wavelength = numpy.cumsum(numpy.linspace(0.5, 1.5, 100))
+    flux = numpy.sin(wavelength) + 2
+    grid, rebinned = analyzer.resample(wavelength, flux, method="rebin", size=60)
+    source = numpy.sum(flux * numpy.diff(analyzer._bin_edges(wavelength)))
+    target = numpy.sum(rebinned * numpy.diff(analyzer._bin_edges(grid)))
+    assert abs(source - target) / source < 0.02
+
+
+def test_resample_unsorted():
+    """Test that unsorted x values are sorted together with y values before resampling."""
+    grid, resampled = analyzer.resample([3.0, 1.0, 2.0], [30.0, 10.0, 20.0])
+    assert numpy.allclose(grid, [1.0, 2.0, 3.0])
+    assert numpy.allclose(resampled, [10.0, 20.0, 30.0])
+
+
+def test_fill_nan():
+    """Test that NaN values are interpolated from their neighbours."""
+    data = numpy.array([numpy.nan, 1.0, numpy.nan, 3.0, numpy.inf])
+    res = analyzer.fill_nan(data)
+    assert res is data
+    assert numpy.allclose(data, [1.0, 1.0, 2.0, 3.0, 3.0])
+    data = numpy.array([0.0, numpy.nan, 10.0])
+    analyzer.fill_nan(data, wavelength=numpy.array([0.0, 1.0, 4.0]))
+    assert numpy.allclose(data, [0.0, 2.5, 10.0])
+    with pytest.raises(ValueError):
+        analyzer.fill_nan(numpy.array([numpy.nan, numpy.nan]))
+
+
+def test_normalize_constant():
+    """Test that constant spectrum does not cause division by zero."""
+    for strategy in ("minmax", "zscore"):
+        data = analyzer.normalize(numpy.full(10, 3.0), strategy)
+        assert numpy.all(data == 0.0)
+
+
+def test_normalize_strategies():
+    """Test individual normalization strategies."""
+    x = numpy.linspace(0, 10, 1000)
+    data = analyzer.normalize(numpy.sin(x) * 5 + 3, "minmax")
+    assert normalized(data)
+    assert data.min() == 0.0 and data.max() == 1.0
+    data = analyzer.normalize(numpy.sin(x) * 5 + 3, "zscore")
+    assert abs(data.mean()) < 1e-9
+    assert abs(data.std() - 1.0) < 1e-9
+    continuum = 100 + 10 * x
+    data = analyzer.normalize(continuum - 20 * numpy.exp(-(x - 5) ** 2 * 50), "continuum")
+    assert abs(numpy.median(data) - 1.0) < 0.01
+    assert data.min() < 0.9
+    with pytest.raises(ValueError):
+        analyzer.normalize(data, "unknown")
+
+
+def test_read_spectrum_with_nan(tmpdir):
+    """Test that single NaN value in a spectrum file does not poison the whole spectrum."""
+    file = tmpdir.join("spectrum.csv")
+    file.write("1.0,1.0\n2.0,nan\n3.0,3.0\n4.0,4.0\n5.0,2.0\n")
+    res = analyzer.Spectrum.read_spectrum(str(file))
+    assert res is not None
+    assert numpy.all(numpy.isfinite(res.spectrum))
+    assert normalized(res.spectrum)
+
+
+def test_scale_range():
+    """Test that only scales in the range are computed and the reduced spectrum does not depend on history."""
+    full = analyzer.Spectrum.read_spectrum(file_ref("binary.vot"))
+    assert full.computed_range == (0, 48)
+    spectrum = analyzer.Spectrum.read_spectrum(file_ref("binary.vot"), scale_range=(full.scales[10], full.scales[20]))
+    assert len(spectrum.scales) == 48
+    assert spectrum.computed_range == (10, 21)
+    assert spectrum.freq0 == 10
+    assert numpy.allclose(spectrum._transformation[10:21], full._transformation[10:21])
+    assert not numpy.any(spectrum._transformation[:10])
+    before = spectrum.reduced_spectrum(10, 2)
+    outside = [spectrum.reduced_spectrum(*window) for window in ((25, 5), (30, 10), (0, 3))]
+    for i, reduced in enumerate(outside):
+        assert not any(numpy.allclose(reduced, other) for other in outside[i + 1:] + [before])
+    # rows between the computed range and the window are computed as in the full transformation
+    expected = full._transformation.copy()
+    expected[:10] = expected[30:] = expected[25:30] = 0
+    import mlpy.wavelet as wave
+    rec = analyzer.normalize_minmax(wave.icwt(expected, dt=1, scales=full.scales, wf="dog", p=2))
+    assert numpy.allclose(outside[0], rec)
+    spectrum.modify_parameters(2, 3)
+    spectrum.plot_reduced_spectrum()
+    assert spectrum.computed_range == (10, 21)
+    assert not numpy.any(spectrum._transformation[21:])
+    assert numpy.array_equal(spectrum.reduced_spectrum(10, 2), before)
+    assert numpy.array_equal(spectrum.reduced_spectrum(25, 5), outside[0])
+
+
+def test_explicit_scales():
+    """Test transformation over explicit scales and with custom scale spacing."""
+    spectrum = analyzer.Spectrum.read_spectrum(file_ref("binary.vot"), scales=[8.0, 2.0, 4.0])
+    assert list(spectrum.scales) == [2.0, 4.0, 8.0]
+    assert spectrum._transformation.shape[0] == 3
+    assert spectrum.wSize == 2
+    coarse = analyzer.Spectrum.read_spectrum(file_ref("binary.vot"), dj=0.5)
+    assert len(coarse.scales) == 24
+
+
+def test_decimate():
+    """Test that decimated spectrum is short but keeps extremes of the original spectrum."""
+    values = numpy.random.RandomState(0).rand(100000)
+    values[12345] = 5.0
+    values[54321] = -5.0
+    x, y = analyzer.decimate(values, points=1000)
+    assert x.shape == y.shape
+    assert y.shape[0] <= 1001
+    assert y.max() == 5.0 and y.min() == -5.0
+    assert numpy.all(numpy.diff(x) > 0)
+    wavelength = numpy.linspace(4000, 5000, 500)
+    x, y = analyzer.decimate(values[:500], wavelength, points=1000)
+    assert x is wavelength and y.shape[0] == 500
+
+
+def test_read_cache(monkeypatch):
+    """Test that read spectra are cached up to the size limit and files read once are not cached."""
+    cache = analyzer.ReadCache(max_bytes=200)
+    cache.put("a", (None, numpy.zeros(5)))
+    cache.put("b", (numpy.zeros(5), numpy.zeros(5)))
+    assert cache.get("a") is not None
+    cache.put("c", (None, numpy.zeros(11)))
+    assert cache.get("b") is None and len(cache) == 2
+    cache.put("large", (None, numpy.zeros(30)))
+    assert cache.get("large") is None
+    monkeypatch.setattr(analyzer, "read_cache", analyzer.ReadCache())
+    data = analyzer.Spectrum.read_data(file_ref("binary.vot"), cached=False)
+    assert len(analyzer.read_cache) == 0
+    data = analyzer.Spectrum.read_data(file_ref("binary.vot"))
+    assert analyzer.Spectrum.read_data(file_ref("binary.vot")) is data
+    assert len(analyzer.read_cache) == 1
@@ -0,0 +1,44 @@
+import os
+import hashlib
+from spectra_analyzer import dedup
+
+
+def test_content_hash(tmpdir):
+    """Test that content hash is computed from the whole file content and reflects modifications."""
+    file = tmpdir.join("spectrum.csv")
+    content = b"1,2\n" * 500000
+    file.write_binary(content)
+    assert dedup.content_hash(str(file)) == hashlib.sha256(content).hexdigest()
+    file.write_binary(b"1,2\n")
+    assert dedup.content_hash(str(file)) == hashlib.sha256(b"1,2\n").hexdigest()
+
+
+def test_register_duplicate(tmpdir):
+    """Test that duplicates are replaced by hard links to the canonical file."""
+    index = dedup.ContentIndex(str(tmpdir))
+    first = tmpdir.join("first.csv")
+    first.write("1,2\n")
+    second = tmpdir.join("second.csv")
+    second.write("1,2\n")
+    digest, canonical = index.register(str(first), ["http://archive/first"])
+    assert canonical == str(first)
+    assert index.register(str(second), ["http://archive/second"]) == (digest, str(first))
+    assert os.path.samefile(str(first), str(second))
+    assert index.canonical(digest) == str(first)
+    assert index.known_remote("http://archive/second") == str(first)
+    assert index.known_remote("http://archive/unknown") is None
+
+
+def test_stale_canonical(tmpdir):
+    """Test that removed or modified canonical files are dropped from the index."""
+    index = dedup.ContentIndex(str(tmpdir))
+    file = tmpdir.join("spectrum.csv")
+    file.write("1,2\n")
+    digest, _ = index.register(str(file), ["spectrum"])
+    file.write("3,4\n")
+    assert index.canonical(digest) is None
+    assert index.known_remote("spectrum") is None
+    digest, _ = index.register(str(file), ["spectrum"])
+    index.close()
+    file.remove()
+    assert dedup.ContentIndex(str(tmpdir)).known_remote("spectrum") is None
@@ -0,0 +1,58 @@
+import pytest
+import sys
+import time
+import subprocess
+import socketio
+from spectra_analyzer import messaging
+
+EMITTER = """
+import sys
+from spectra_analyzer.messaging import SqliteManager
+SqliteManager(sys.argv[1], write_only=True).emit("ping", {"sender": "worker"}, namespace="/analyzer", room=sys.argv[2])
+"""
+
+
+def test_publish_and_listen(tmpdir):
+    """Test that messages published by one manager are received by the others."""
+    path = str(tmpdir.join("queue.db"))
+    old = messaging.SqliteManager(path)
+    old._publish({"method": "emit", "n": 0})
+    publisher = messaging.SqliteManager(path)
+    listener = messaging.SqliteManager(path)
+    other_channel = messaging.SqliteManager(path, channel="other")
+    publisher._publish({"method": "emit", "n": 1})
+    publisher._publish({"method": "emit", "n": 2})
+    assert listener._fetch() == [{"method": "emit", "n": 1}, {"method": "emit", "n": 2}]
+    assert listener._fetch() == []
+    assert next(old._listen()) == {"method": "emit", "n": 0}
+    assert other_channel._fetch() == []
+
+
+def test_queue_options(tmpdir):
+    """Test selection of the client manager by the message queue URL."""
+    assert messaging.queue_options(None) == {}
+    assert messaging.queue_options("redis://localhost:6379/0") == {"message_queue": "redis://localhost:6379/0"}
+    manager = messaging.queue_options("sqlite://" + str(tmpdir.join("queue.db")))["client_manager"]
+    assert isinstance(manager, messaging.SqliteManager)
+    with pytest.raises(ValueError):
+        messaging.queue_options("sqlite://")
+
+
+def test_cross_process_emit(tmpdir, monkeypatch):
+    """Test that messages emitted by another process through the queue reach clients of the server."""
+    path = str(tmpdir.join("queue.db"))
+    manager = messaging.SqliteManager(path, poll_interval=0.01)
+    server = socketio.Server(client_manager=manager, async_mode="threading")
+    sent = list()
+    monkeypatch.setattr(server, "_send_eio_packet", lambda eio_sid, packet: sent.append((eio_sid, packet.data)))
+    sid = manager.connect("client", "/analyzer")
+    manager.connect("other", "/analyzer")
+    manager.initialize()  # starts the listener thread
+    subprocess.run([sys.executable, "-c", EMITTER, path, sid], check=True)
+    deadline = time.monotonic() + 10
+    while not sent and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert len(sent) == 1
+    eio_sid, data = sent[0]
+    assert eio_sid == "client"
+    assert data.startswith("2/analyzer,") and '"ping"' in data and '"worker"' in data
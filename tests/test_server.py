@@ -1,5 +1,14 @@
 import pytest
-from spectra_analyzer import server
+import collections
+import io
+import os
+import sys
+import subprocess
+import urllib
+import numpy
+from click.testing import CliRunner
+from tests import test_analyzer, test_similarity
+from spectra_analyzer import server, dedup, store
 
 
 @pytest.mark.parametrize("input, expected", [(0, "0 B"), (500, "500 B"),
@@ -74,3 +83,341 @@ def test_serialize_path2(tmpdir):
     assert files == 3
     assert back
     assert selected
+
+
+def test_serialize_delta(tmpdir):
+    """Test serialization of watched directory changes."""
+    tmpdir.mkdir("dir1")
+    tmpdir.join("file1").write("content")
+    res = server.serialize_delta(str(tmpdir), ["dir1", "file1", "vanished"], [], ["file2"])
+    assert [item["name"] for item in res["added"]] == ["dir1", "file1"]
+    assert not res["added"][0]["is_file"]
+    assert res["added"][1]["size"] == "7 B"
+    assert res["modified"] == []
+    assert res["removed"] == [str(tmpdir.join("file2"))]
+
+
+DownloadResult = collections.namedtuple("DownloadResult", ["name", "url", "success", "exception"])
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    """Captures messages emitted by the socketio server."""
+    messages = list()
+    monkeypatch.setattr(server.socketio, "emit", lambda event, message, **kwargs: messages.append((event, message)))
+    monkeypatch.setattr(server.socketio, "sleep", lambda seconds=0: None)
+    return messages
+
+
+def test_download_progress_batching(tmpdir, emitted):
+    """Test that download results are aggregated into batched progress messages."""
+    for i in range(5):
+        tmpdir.join("file{}".format(i)).write("x" * 10)
+    progress = server.DownloadProgress("sid", str(tmpdir), 6, interval=3600, batch=3)
+    for i in range(5):
+        progress.add(DownloadResult("file{}".format(i), "url", True, None))
+    progress.add(DownloadResult("missing", "url", False, ValueError("not found")))
+    assert [event for event, _ in emitted] == ["download_progress", "download_progress"]
+    first, second = emitted[0][1], emitted[1][1]
+    assert first["downloaded"] == 3
+    assert first["bytes"] == 30
+    assert first["failures"] == []
+    assert second["downloaded"] == 5
+    assert second["failed"] == 1
+    assert second["bytes"] == 50
+    assert second["failures"] == [{"file_name": "missing", "url": "url", "exception": "not found"}]
+    progress.finish(False)
+    assert emitted[-2][0] == "download_progress"
+    assert emitted[-2][1]["total"] == 6
+    assert emitted[-1] == ("spectra_downloaded", False)
+
+
+def test_download_progress_duplicates(tmpdir, emitted):
+    """Test that downloaded spectra are registered in the content index and duplicates are counted."""
+    tmpdir.join("a.csv").write("1,2\n")
+    tmpdir.join("b.csv").write("1,2\n")
+    index = dedup.ContentIndex(str(tmpdir))
+    progress = server.DownloadProgress("sid", str(tmpdir), 3, content_index=index,
+                                       identifiers={"a.csv": "a.csv?format=csv"}, skipped=1)
+    progress.add(DownloadResult("a.csv", "http://archive/a", True, None))
+    progress.add(DownloadResult("b.csv", "http://archive/b", True, None))
+    progress.finish(True)
+    message = emitted[-2][1]
+    assert message["downloaded"] == 2
+    assert message["duplicates"] == 1
+    assert message["skipped"] == 1
+    index = dedup.ContentIndex(str(tmpdir))
+    assert index.known_remote("a.csv?format=csv") == str(tmpdir.join("a.csv"))
+    assert index.known_remote("http://archive/b") == str(tmpdir.join("a.csv"))
+
+
+def test_staged_analysis(emitted):
+    """Test that spectrum analysis results are sent in stages."""
+    path = test_analyzer.file_ref("binary.vot")
+    token = server.analyses["sid"] = object()
+    server.run_analysis("sid", token, path, server.analysis_options(dict()))
+    assert [event for event, _ in emitted] == ["spectrum_preview", "scales_computed", "cwt_plotted", "file_analyzed"]
+    assert all(message["path"] == path for _, message in emitted)
+    assert emitted[0][1]["file_name"] == "binary.vot"
+    assert emitted[1][1]["computed"] == (0, emitted[1][1]["scales"])
+    assert not emitted[-1][1]["invalid"]
+    server.analyses.pop("sid")
+
+
+def test_cancelled_analysis(emitted, monkeypatch):
+    """Test that analysis is abandoned when the client selects another spectrum."""
+    path = test_analyzer.file_ref("binary.vot")
+    token = server.analyses["sid"] = object()
+    monkeypatch.setattr(server.socketio, "sleep", lambda seconds=0: server.analyses.update(sid=object()))
+    server.run_analysis("sid", token, path, server.analysis_options(dict()))
+    assert [event for event, _ in emitted] == ["spectrum_preview"]
+    server.analyses.pop("sid")
+    server.run_analysis("sid", token, test_analyzer.file_ref("missing.vot"), server.analysis_options(dict()))
+    assert emitted[-1][0] == "file_analyzed"
+    assert emitted[-1][1]["invalid"]
+
+
+def test_precompute_limit(tmpdir, monkeypatch):
+    """Test that precomputation does not queue more spectra than the spectrum store can keep."""
+    tasks = list()
+    monkeypatch.setattr(server, "spectrum_store", store.MemoryStore(max_entries=8))
+    monkeypatch.setattr(server, "precompute_pending", set())
+    monkeypatch.setattr(server.socketio, "start_background_task", lambda *args: tasks.append(args))
+    server.schedule_precompute(str(tmpdir), ["notes.md"] + ["spectrum{}.csv".format(i) for i in range(10)])
+    assert len(tasks) == 1
+    assert tasks[0][1] == [str(tmpdir.join("spectrum{}.csv".format(i))) for i in range(4)]
+    server.schedule_precompute(str(tmpdir), ["new.csv"])
+    assert len(tasks) == 1
+    server.precompute(tasks[0][1])  # files do not exist, nothing is stored
+    assert not server.precompute_pending
+    server.schedule_precompute(str(tmpdir), ["new.csv"])
+    assert tasks[-1][1] == [str(tmpdir.join("new.csv"))]
+
+
+def test_precompute_failure(tmpdir, monkeypatch):
+    """Test that files removed during precomputation and unprocessed files of a failed task are not left pending."""
+    paths = [str(tmpdir.join("spectrum{}.csv".format(i))) for i in range(3)]
+    monkeypatch.setattr(server, "precompute_pending", set(paths))
+    def load_spectrum(file_path):
+        raise ValueError("Spectrum file does not exist")  # file is removed after the check of its existence
+
+    monkeypatch.setattr(server, "load_spectrum", load_spectrum)
+    server.precompute(paths[:1])
+    assert server.precompute_pending == set(paths[1:])
+
+    def sleep(seconds=0):
+        raise RuntimeError("task killed")
+
+    monkeypatch.setattr(server.socketio, "sleep", sleep)
+    with pytest.raises(RuntimeError):
+        server.precompute(paths[1:])
+    assert not server.precompute_pending
+
+
+def test_shared_watcher(tmpdir, monkeypatch):
+    """Test that clients listing the same directory share one watcher and all of them receive its changes."""
+    tasks, messages, precomputed = list(), list(), list()
+    monkeypatch.setattr(server, "watchers", dict())
+    monkeypatch.setattr(server, "subscriptions", dict())
+    monkeypatch.setattr(server.socketio, "start_background_task", lambda *args: tasks.append(args))
+    monkeypatch.setattr(server.socketio, "sleep", lambda seconds=0: None)
+    monkeypatch.setattr(server.socketio, "emit", lambda event, message, room=None, **kwargs:
+                        messages.append((event, message["path"], room)))
+    monkeypatch.setattr(server, "schedule_precompute", lambda path, files: precomputed.append(files))
+    server.watch_directory("first", str(tmpdir))
+    server.watch_directory("second", str(tmpdir))
+    server.watch_directory("other", str(tmpdir.mkdir("other")))
+    assert len(tasks) == 2
+    assert len(server.watchers) == 2
+    watcher = server.watchers[str(tmpdir)]
+    server.unwatch_directory("other")
+    assert list(server.watchers) == [str(tmpdir)]
+    tmpdir.join("new.csv").write("1,2\n")
+    deltas = iter([None, (["new.csv"], [], [])])
+
+    def poll():
+        delta = next(deltas, None)
+        if delta is None and messages:  # both clients leave after the change is delivered
+            server.unwatch_directory("first")
+            server.unwatch_directory("second")
+        return delta
+
+    monkeypatch.setattr(watcher, "poll", poll)
+    tasks[0][0]()
+    assert messages == [("directory_delta", str(tmpdir), "first"), ("directory_delta", str(tmpdir), "second")]
+    assert precomputed == [["new.csv"]]
+    assert server.watchers == {} and server.subscriptions == {}
+
+
+def test_search_similar(tmpdir, emitted, monkeypatch):
+    """Test that similar spectra are found in the background and the index is updated afterwards."""
+    for i in range(3):
+        test_similarity.write_spectrum(tmpdir.join("spectrum{}.csv".format(i)), 0.05 * (i + 1))
+    path = str(tmpdir.join("spectrum0.csv"))
+    tasks = list()
+    monkeypatch.setattr(server.socketio, "start_background_task", lambda *args: tasks.append(args))
+    server.search_similar("sid", path, 5)
+    event, message = emitted[-1]
+    assert event == "similar_spectra"
+    assert not message["invalid"]
+    assert len(message["spectra"]) == 2
+    assert tasks == []  # index has been built by the search itself
+    server.search_similar("sid", path, 5)
+    assert not emitted[-1][1]["invalid"]
+    assert tasks == []  # the build is the recent update
+    monkeypatch.setitem(server.index_updated, str(tmpdir), -server.INDEX_UPDATE_INTERVAL)
+    server.search_similar("sid", path, 5)
+    assert tasks == [(server.update_index, str(tmpdir))]
+    server.search_similar("sid", path, 5)
+    assert len(tasks) == 1  # update is already running
+    server.update_index(str(tmpdir))
+    server.search_similar("sid", path, 5)
+    assert len(tasks) == 1  # index has been updated recently
+
+
+def test_search_similar_without_spectra(tmpdir, emitted, monkeypatch):
+    """Test that a directory without valid spectra is indexed once and other builds are awaited."""
+    tmpdir.join("README.txt").write("not a spectrum")
+    tmpdir.join("notes.csv").write("not a spectrum")
+    reads = list()
+    read_spectrum = server.SpectraIndex._entry
+    monkeypatch.setattr(server.SpectraIndex, "_entry", lambda index, name: reads.append(name) or
+                        read_spectrum(index, name))
+    server.search_similar("sid", str(tmpdir.join("notes.csv")), 5)
+    assert emitted[-1][1]["invalid"]
+    assert sorted(reads) == ["README.txt", "notes.csv"]
+    assert server.SpectraIndex(str(tmpdir)).exists
+    monkeypatch.setitem(server.index_updated, str(tmpdir), -server.INDEX_UPDATE_INTERVAL)
+    server.search_similar("sid", str(tmpdir.join("notes.csv")), 5)
+    server.update_index(str(tmpdir))
+    assert len(reads) == 2  # rejected files are not read again
+    other = tmpdir.mkdir("other")
+    test_similarity.write_spectrum(other.join("spectrum.csv"), 0.05)
+    waits = list()
+
+    def sleep(seconds=0):
+        waits.append(seconds)
+        server.index_updating.discard(str(other))  # other task finishes its build
+        if seconds:
+            server.SpectraIndex(str(other)).update()
+
+    monkeypatch.setattr(server.socketio, "sleep", sleep)
+    server.index_updating.add(str(other))
+    index = server.build_index(str(other))
+    assert waits == [server.INDEX_WAIT_INTERVAL]
+    assert len(index) == 1
+    assert reads.count("spectrum.csv") == 1  # built by the other task only
+
+
+def test_search_similar_read_only(tmpdir, emitted, monkeypatch):
+    """Test that the client is answered when the index cannot be written."""
+    test_similarity.write_spectrum(tmpdir.join("spectrum.csv"), 0.05)
+
+    def save(index):
+        raise PermissionError("read-only archive")
+
+    monkeypatch.setattr(server.SpectraIndex, "save", save)
+    server.search_similar("sid", str(tmpdir.join("spectrum.csv")), 5)
+    assert emitted[-1] == ("similar_spectra", {"path": str(tmpdir.join("spectrum.csv")), "invalid": True})
+
+
+@pytest.fixture
+def client():
+    """Returns test client of the flask application."""
+    server.app.config["TESTING"] = True
+    return server.app.test_client()
+
+
+def api_url(**params):
+    """Returns URL of the analysis API with passed query parameters."""
+    return "/spectra-analyzer/api/spectrum?" + urllib.parse.urlencode(params)
+
+
+def test_api_conditional(client):
+    """Test that analysis API responses are cacheable and conditional requests are answered with 304."""
+    path = test_analyzer.file_ref("binary.vot")
+    response = client.get(api_url(path=path, freq0=2, wSize=3))
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    etag = response.headers["ETag"]
+    assert "max-age" in response.headers["Cache-Control"]
+    response = client.get(api_url(path=path, freq0=2, wSize=3), headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    response = client.get(api_url(path=path, freq0=2, wSize=4), headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_api_formats(client):
+    """Test data formats of the analysis API."""
+    path = test_analyzer.file_ref("binary.vot")
+    response = client.get(api_url(path=path, freq0=100, wSize=3, format="json"))
+    data = response.get_json()
+    assert data["freq0"] == data["scales"] - 1
+    assert data["wSize"] == 0
+    assert len(data["values"]) == len(data["wavelength"])
+    response = client.get(api_url(path=path, kind="cwt", format="npy"))
+    array = numpy.load(io.BytesIO(response.data))
+    assert array.shape[0] == data["scales"]
+
+
+def test_api_scale_range(client):
+    """Test that analysis API computes only the requested scales."""
+    path = test_analyzer.file_ref("binary.vot")
+    response = client.get(api_url(path=path, format="json", min_scale=4, max_scale=16))
+    data = response.get_json()
+    start, stop = data["computed"]
+    assert 0 < start < stop < data["scales"]
+    assert data["freq0"] == start
+    response = client.get(api_url(path=path, format="json"))
+    assert response.get_json()["computed"] == [0, data["scales"]]
+
+
+@pytest.mark.parametrize("params, status", [({}, 400), ({"path": "/nonexistent.vot"}, 404),
+                                            ({"format": "gif"}, 400), ({"kind": "unknown"}, 400),
+                                            ({"dj": "x"}, 400), ({"dj": "-1"}, 400),
+                                            ({"freq0": "abc"}, 400), ({"wSize": "1.5"}, 400),
+                                            ({"freq0": "2", "wSize": ""}, 400)])
+def test_api_errors(client, params, status):
+    """Test that invalid analysis API requests are rejected."""
+    if status == 400 and params:
+        params["path"] = test_analyzer.file_ref("binary.vot")
+    response = client.get(api_url(**params))
+    assert response.status_code == status
+    assert "error" in response.get_json()
+
+
+def test_lazy_imports():
+    """Test that importing the server does not import heavy modules - they must be imported on their first use."""
+    code = "import sys, spectra_analyzer.server; print(' '.join(sorted(sys.modules)))"
+    process = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True,
+                             universal_newlines=True)
+    modules = process.stdout.split()
+    for heavy in ("astropy", "mlpy", "matplotlib", "spectra_downloader"):
+        assert heavy not in modules
+
+
+def test_message_queue_mode(tmpdir):
+    """Test that the message queue is used with monkey patched eventlet or threading async mode."""
+    code = ("import sys, spectra_analyzer.server as s; print(s.ASYNC_MODE, s.socketio.server.manager.name, "
+            "'eventlet' not in sys.modules or sys.modules['eventlet'].patcher.is_monkey_patched('socket'))")
+    env = dict(os.environ, SPECTRA_ANALYZER_MESSAGE_QUEUE="sqlite://" + str(tmpdir.join("queue.db")))
+    process = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True,
+                             universal_newlines=True, env=env)
+    mode, manager, patched = process.stdout.split()
+    assert mode in ("eventlet", "threading")
+    assert manager == "sqlite"
+    assert patched == "True"
+
+
+def test_web_preload(monkeypatch):
+    """Test that the --preload flag imports heavy modules before the server is started."""
+    pytest.importorskip("spectra_downloader")
+    started = list()
+    monkeypatch.setattr(server.socketio, "run", lambda app, **kwargs: started.append(kwargs["port"]))
+    result = CliRunner().invoke(server.web, ["--preload", "--port", "5099"])
+    assert result.exit_code == 0, result.output
+    assert started == [5099]
+    for heavy in ("astropy.io.fits", "mlpy.wavelet", "matplotlib.pyplot", "spectra_downloader"):
+        assert heavy in sys.modules
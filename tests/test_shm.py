@@ -0,0 +1,136 @@
+import pytest
+import os
+import pickle
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy
+from tests import test_analyzer
+from spectra_analyzer import analyzer, shm
+
+
+def _reduce_in_child(handle, queue):
+    """Attaches shared spectrum in a child process and sends back its reduced spectrum."""
+    spectrum = handle.attach()
+    queue.put((spectrum._transformation.flags.writeable, spectrum.reduced_spectrum(2, 3)))
+
+
+def test_shared_arrays():
+    """Test that arrays are shared zero-copy and handles are small."""
+    arrays = {"a": numpy.arange(1000, dtype=float), "b": numpy.ones((3, 7), dtype=numpy.int32)}
+    handle = shm.SharedArrays.create(arrays)
+    assert len(pickle.dumps(handle)) < 500
+    attached = pickle.loads(pickle.dumps(handle)).attach()
+    assert numpy.array_equal(attached["a"], arrays["a"])
+    assert numpy.array_equal(attached["b"], arrays["b"])
+    assert not attached["a"].flags.writeable
+    assert attached["a"].ctypes.data % shm.ALIGNMENT == 0 and attached["b"].ctypes.data % shm.ALIGNMENT == 0
+    shm.release(handle)
+    assert numpy.array_equal(attached["a"], arrays["a"])  # mapping lives as long as the arrays
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=handle.name)
+
+
+def test_segment_closed_with_arrays():
+    """Test that segment closed while its arrays are alive is closed together with the last of them."""
+    handle = shm.SharedArrays.create({"a": numpy.arange(10.0), "b": numpy.arange(5)})
+    segment = shm._owned[handle.name]
+    arrays = handle.attach()
+    again = handle.attach()["a"]
+    shm.release(handle)
+    assert segment in shm._closing and segment.buf is not None
+    assert arrays["a"].sum() == 45
+    del arrays
+    assert segment.buf is not None
+    assert again[-1] == 9
+    del again
+    assert segment not in shm._closing and segment not in shm._mapped
+    assert segment.buf is None
+
+
+def test_shared_spectrum_in_worker():
+    """Test that a worker process attaches shared spectrum and gets the same results."""
+    spectrum = analyzer.Spectrum.read_spectrum(test_analyzer.file_ref("binary.vot"))
+    handle = shm.SharedSpectrum.create(spectrum)
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_reduce_in_child, args=(handle, queue))
+    process.start()
+    writeable, reduced = queue.get(timeout=60)
+    process.join()
+    assert process.exitcode == 0
+    assert not writeable
+    assert numpy.allclose(reduced, spectrum.reduced_spectrum(2, 3))
+    shm.release(handle)
+
+
+def test_shared_scale_range():
+    """Test that attached spectrum with limited scale range gives the same results."""
+    full = analyzer.Spectrum.read_spectrum(test_analyzer.file_ref("binary.vot"))
+    spectrum = analyzer.Spectrum.read_spectrum(test_analyzer.file_ref("binary.vot"),
+                                               scale_range=(full.scales[10], full.scales[20]))
+    handle = shm.SharedSpectrum.create(spectrum)
+    attached = handle.attach()
+    assert attached.computed_range == (10, 21)
+    assert attached.freq0 == spectrum.freq0
+    assert numpy.allclose(attached.reduced_spectrum(25, 5), spectrum.reduced_spectrum(25, 5))
+    shm.release(handle)
+
+
+def test_shared_buffers_leases():
+    """Test that evicted spectra are unlinked when their last lease is released."""
+    spectrum = analyzer.Spectrum.read_spectrum(test_analyzer.file_ref("binary.vot"))
+    buffers = shm.SharedBuffers(max_bytes=1)
+    first = buffers.share("a", spectrum)
+    assert buffers.get("a").name == first.name
+    second = buffers.share("b", spectrum)
+    assert len(buffers) == 1
+    assert buffers.get("a") is None
+    buffers.release(first)
+    assert first.name in shm._owned
+    buffers.release(first)
+    assert first.name not in shm._owned
+    buffers.release(second)
+    assert second.name in shm._owned
+    buffers.evict("b")
+    assert second.name not in shm._owned
+    buffers.share("c", spectrum)
+    buffers.close()
+    assert not shm._owned
+
+
+def test_shared_buffers_concurrent_share(monkeypatch):
+    """Test that a spectrum shared concurrently by two threads is stored in one segment."""
+    spectrum = analyzer.Spectrum.read_spectrum(test_analyzer.file_ref("binary.vot"))
+    buffers = shm.SharedBuffers()
+    create = shm.SharedSpectrum.create
+    created = list()
+
+    def racing_create(spectrum):
+        handle = create(spectrum)
+        created.append(handle)
+        if len(created) == 1:
+            created.append(buffers.share("a", spectrum))  # other thread wins while the segment is being created
+        return handle
+
+    monkeypatch.setattr(shm.SharedSpectrum, "create", racing_create)
+    handle = buffers.share("a", spectrum)
+    loser, _, winner = created
+    assert handle.name == winner.name
+    assert loser.name not in shm._owned
+    assert buffers._leases == {winner.name: 2}
+    assert buffers._size == winner.size and len(buffers) == 1
+    buffers.close()
+    assert not shm._owned
+
+
+@pytest.mark.skipif(not os.path.isdir(shm.SEGMENT_DIRECTORY), reason="segments are not listed in the filesystem")
+def test_cleanup_orphans():
+    """Test that segments of processes which no longer exist are removed."""
+    process = multiprocessing.Process(target=int)
+    process.start()
+    process.join()
+    name = "{}{}_{}".format(shm.SEGMENT_PREFIX, process.pid, "0123456789ab")
+    segment = shared_memory.SharedMemory(name=name, create=True, size=16)
+    resource_tracker.unregister(segment._name, "shared_memory")
+    segment.close()
+    assert shm.cleanup_orphans() >= 1
+    assert not os.path.exists(os.path.join(shm.SEGMENT_DIRECTORY, name))
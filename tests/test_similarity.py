@@ -0,0 +1,94 @@
+import pytest
+import os
+import shutil
+import numpy
+from click.testing import CliRunner
+from tests import test_analyzer
+from spectra_analyzer import similarity
+
+
+def write_spectrum(path, frequency, noise=0.0, seed=0):
+    """Writes synthetic spectrum with a dominant frequency into a csv file."""
+    x = numpy.linspace(6000, 6500, 1500)
+    y = numpy.sin(x * frequency) + numpy.random.RandomState(seed).normal(0, noise, x.shape[0])
+    numpy.savetxt(str(path), numpy.column_stack((x, y)), delimiter=",")
+
+
+@pytest.fixture
+def archive(tmpdir):
+    """Returns directory with synthetic spectra of three different kinds."""
+    for i in range(3):
+        write_spectrum(tmpdir.join("slow{}.csv".format(i)), 0.05, noise=0.05, seed=i)
+        write_spectrum(tmpdir.join("fast{}.csv".format(i)), 2.0, noise=0.05, seed=i)
+    sub = tmpdir.mkdir("sub")
+    shutil.copy(test_analyzer.file_ref("binary.vot"), str(sub))
+    tmpdir.join("notes.md").write("not a spectrum")
+    return tmpdir
+
+
+def test_feature_vector():
+    """Test that feature vectors have fixed size and unit length."""
+    spectrum = similarity.Spectrum.read_spectrum(test_analyzer.file_ref("binary.vot"))
+    vector = similarity.feature_vector(spectrum)
+    assert vector.shape == (similarity.FEATURE_SIZE,)
+    assert abs(numpy.linalg.norm(vector) - 1.0) < 1e-5
+
+
+def test_index_query(archive):
+    """Test that the most similar spectra are spectra of the same kind."""
+    index = similarity.SpectraIndex(str(archive))
+    assert index.update() == (7, 0)
+    results = index.query_file(str(archive.join("slow0.csv")), k=2)
+    assert [os.path.basename(path) for path, _ in results] == ["slow1.csv", "slow2.csv"]
+    assert results[0][1] >= results[1][1]
+    results = similarity.SpectraIndex(str(archive)).query_file(str(archive.join("fast1.csv")), k=2)
+    assert sorted(os.path.basename(path) for path, _ in results) == ["fast0.csv", "fast2.csv"]
+
+
+def test_index_incremental(archive):
+    """Test that only changes of the directory are reflected by the index update."""
+    index = similarity.SpectraIndex(str(archive))
+    index.update()
+    assert index.update() == (0, 0)
+    archive.join("fast0.csv").remove()
+    write_spectrum(archive.join("slow3.csv"), 0.05, seed=3)
+    write_spectrum(archive.join("fast1.csv"), 0.05, seed=4)
+    indexed = []
+    assert index.update(progress_callback=indexed.append) == (2, 1)
+    assert sorted(indexed) == ["fast1.csv", "slow3.csv"]
+    index = similarity.SpectraIndex(str(archive))
+    assert len(index) == 7
+    assert index.remove(str(archive.join("slow3.csv")))
+    assert not index.remove(str(archive.join("slow3.csv")))
+    assert len(index) == 6
+    assert index.add(str(archive.join("slow3.csv")))
+    assert len(index) == 7
+
+
+def test_cli(archive):
+    """Test command line interface of the similarity index."""
+    runner = CliRunner()
+    result = runner.invoke(similarity.cli, ["update", str(archive)])
+    assert result.exit_code == 0
+    assert "7 spectra indexed" in result.output
+    result = runner.invoke(similarity.cli, ["query", str(archive.join("fast2.csv")), "-k", "3"])
+    assert result.exit_code == 0
+    assert len(result.output.splitlines()) == 3
+
+
+def test_index_rejected(archive):
+    """Test that files which are not valid spectra are read again only when they are modified."""
+    archive.join("README.txt").write("not a spectrum")
+    index = similarity.SpectraIndex(str(archive))
+    index.update()
+    assert sorted(index.rejected) == ["README.txt"]
+    indexed = []
+    assert similarity.SpectraIndex(str(archive)).update(progress_callback=indexed.append) == (0, 0)
+    assert indexed == []
+    archive.join("README.txt").write("still not a spectrum")
+    index = similarity.SpectraIndex(str(archive))
+    index.update(progress_callback=indexed.append)
+    assert indexed == ["README.txt"]
+    archive.join("README.txt").remove()
+    index.update()
+    assert similarity.SpectraIndex(str(archive)).rejected == {}
@@ -0,0 +1,69 @@
+import pytest
+import multiprocessing
+import numpy
+from spectra_analyzer import store
+
+
+def test_file_key(tmpdir):
+    """Test that file key changes when the file is modified and that duplicates share the key."""
+    file = tmpdir.join("spectrum.csv")
+    file.write("1,1\n")
+    key = store.file_key(str(file))
+    assert store.file_key(str(file)) == key
+    tmpdir.join("copy.csv").write("1,1\n")
+    assert store.file_key(str(tmpdir.join("copy.csv"))) == key
+    tmpdir.join("copy.txt").write("1,1\n")
+    assert store.file_key(str(tmpdir.join("copy.txt"))) != key
+    file.write("1,1\n2,2\n")
+    assert store.file_key(str(file)) != key
+
+
+def test_memory_store_eviction():
+    """Test that memory store evicts least recently used values."""
+    s = store.MemoryStore(max_entries=2)
+    s.put("a", 1)
+    s.put("b", 2)
+    assert s.get("a") == 1
+    s.put("c", 3)
+    assert s.get("b") is None
+    assert s.get("a") == 1
+    assert s.get("c") == 3
+    s.discard("a")
+    assert s.get("a") is None
+
+
+def _put_in_child(path):
+    """Stores value from a different process."""
+    store.SqliteStore(path).put("child", numpy.arange(5))
+
+
+def test_sqlite_store_shared(tmpdir):
+    """Test that values stored by one process are visible to other processes."""
+    path = str(tmpdir.join("store.db"))
+    s = store.create_store("sqlite://" + path)
+    s.put("parent", numpy.ones(3))
+    process = multiprocessing.Process(target=_put_in_child, args=(path,))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert numpy.array_equal(s.get("child"), numpy.arange(5))
+    other = store.SqliteStore(path)
+    assert numpy.array_equal(other.get("parent"), numpy.ones(3))
+    other.discard("parent")
+    assert store.SqliteStore(path).get("parent") is None
+
+
+def test_sqlite_store_eviction(tmpdir):
+    """Test that SQLite store keeps only limited number of values."""
+    s = store.SqliteStore(str(tmpdir.join("store.db")), max_entries=2, local_entries=1)
+    for key in ("a", "b", "c"):
+        s.put(key, key)
+    assert store.SqliteStore(s.path).get("a") is None
+    assert s.get("c") == "c"
+
+
+@pytest.mark.parametrize("url", ["redis://localhost", "sqlite://"])
+def test_create_store_invalid(url):
+    """Test that unsupported store URLs are rejected."""
+    with pytest.raises(ValueError):
+        store.create_store(url)
@@ -0,0 +1,68 @@
+import pytest
+import time
+from spectra_analyzer import watcher
+
+
+def wait_for_delta(directory_watcher, timeout=5.0):
+    """Polls the watcher until it reports a delta."""
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        delta = directory_watcher.poll()
+        if delta is not None:
+            return delta
+        time.sleep(0.05)
+    return None
+
+
+@pytest.fixture(params=[False, True], ids=["polling", "watchdog"])
+def directory_watcher(request, tmpdir):
+    """Returns watcher of a temporary directory containing one file and one directory."""
+    if request.param:
+        pytest.importorskip("watchdog")
+    tmpdir.join("old.csv").write("1,1\n")
+    tmpdir.join("changed.csv").write("1,1\n")
+    tmpdir.mkdir("dir")
+    w = watcher.DirectoryWatcher(str(tmpdir), debounce=0.2, use_watchdog=request.param, max_delay=1.0)
+    assert w.notifications == request.param
+    yield w
+    w.stop()
+
+
+def test_watcher_delta(tmpdir, directory_watcher):
+    """Test that added, modified and removed entries are reported."""
+    assert directory_watcher.poll() is None
+    tmpdir.join("new.csv").write("1,1\n")
+    tmpdir.join("changed.csv").write("1,1\n2,2\n")
+    tmpdir.join("old.csv").remove()
+    tmpdir.mkdir("newdir")
+    assert wait_for_delta(directory_watcher) == (["new.csv", "newdir"], ["changed.csv"], ["old.csv"])
+    assert wait_for_delta(directory_watcher, timeout=0.5) is None
+
+
+def test_watcher_debounce(tmpdir, directory_watcher):
+    """Test that a burst of changes is reported as one delta after the directory becomes quiet."""
+    file = tmpdir.join("growing.csv")
+    end = time.monotonic() + 0.5
+    while time.monotonic() < end:
+        file.write("1,1\n", mode="a")
+        assert directory_watcher.poll() is None
+        time.sleep(0.02)
+    assert wait_for_delta(directory_watcher) == (["growing.csv"], [], [])
+
+
+def test_watcher_max_delay(tmpdir, directory_watcher):
+    """Test that changes of a directory which never becomes quiet are reported after the maximal delay."""
+    reported = list()
+    start = time.monotonic()
+    i = 0
+    while time.monotonic() < start + 2.5:
+        tmpdir.join("ingest{:03d}.csv".format(i)).write("1,1\n")
+        i += 1
+        delta = directory_watcher.poll()
+        if delta is not None:
+            reported.append(time.monotonic() - start)
+            assert not delta[2]
+        time.sleep(directory_watcher.debounce / 4)
+    assert reported and reported[0] < 1.5
+    delta = wait_for_delta(directory_watcher)
+    assert delta is not None and "ingest{:03d}.csv".format(i - 1) in delta[0] + delta[1]